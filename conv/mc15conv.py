@@ -3,9 +3,13 @@
 convert files generated by Monte Carlo method in 2015 to my format
 """
 import argparse
+import io
+import mmap
 import sys
 from collections import defaultdict
-from typing import TextIO, Dict
+from typing import TextIO, Dict, BinaryIO
+
+import numpy as np
 
 
 def read_test(fd_test: TextIO):
@@ -22,41 +26,98 @@ def read_test(fd_test: TextIO):
     return pwd_cnt
 
 
-def conv(ranked: TextIO, wanted: Dict[str, int], save2: TextIO, skip_lines: int, pwd_idx: int, rank_idx: int,
-         prob_idx: int):
-    pwd_rank = {}
+def read_lines(fd: BinaryIO):
+    """
+    Memory-map the file and yield its lines as bytes
+
+    :param fd: file opened in binary mode
+    :return: generator of lines, line breaks are kept
+    """
+    try:
+        mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError, io.UnsupportedOperation):
+        # empty files and pipes cannot be mapped
+        yield from fd
+        return
+    with mm:
+        yield from iter(mm.readline, b'')
+
+
+def conv(ranked: BinaryIO, wanted: Dict[str, int], save2: TextIO, skip_lines: int, pwd_idx: int, rank_idx: int,
+         prob_idx: int, flush_every: int = 1 << 16):
+    # one column per field, the i-th row refers to the i-th distinct password
+    seen = set()
+    pwd_list, num_list, prob_list, rank_list = [], [], [], []
+    lines = read_lines(ranked)
     for _ in range(skip_lines):
-        ranked.readline()
-    for line in ranked:
-        line = line.strip("\r\n")
-        items = line.split("\t")
-        pwd = items[pwd_idx]
-        if pwd in pwd_rank:
+        next(lines, None)
+    for line in lines:
+        line = line.strip(b"\r\n")
+        items = line.split(b"\t")
+        # undecodable bytes are kept as lone surrogates, so different passwords stay different
+        pwd = items[pwd_idx].decode('utf-8', 'surrogateescape')
+        if pwd in seen:
             continue
-        if pwd not in wanted:
-            pwd_rank[pwd] = (wanted[pwd], sys.float_info.min, 10 ** 50)
+        seen.add(pwd)
+        pwd_list.append(pwd)
+        num = wanted.get(pwd)
+        if num is None:
+            num_list.append(0)
+            prob_list.append(sys.float_info.min)
+            rank_list.append(10 ** 50)
             continue
+        # float() parses bytes directly
         prob = sys.float_info.min if prob_idx == -1 else items[prob_idx]
         rank = items[rank_idx]
-        if rank == 'inf' or rank == '-inf':
+        if rank == b'inf' or rank == b'-inf':
             rank = 10 ** 50
-        pwd_rank[pwd] = (wanted[pwd], float(prob), float(rank))
-    prev_rank = 0
-    cracked = 0
-    total = sum([n for n, _, _ in pwd_rank.values()])
-    for pwd, (num, prob, rank) in sorted(pwd_rank.items(), key=lambda x: x[1][2]):
-        cracked += num
-        rank = round(max(rank, prev_rank + 1))
-        prev_rank = rank
-        save2.write(f"{pwd}\t{prob}\t{num}\t{rank}\t{cracked}\t{cracked / total * 100:5.2f}\n")
+        num_list.append(num)
+        prob_list.append(float(prob))
+        rank_list.append(float(rank))
+    del seen
+    size = len(pwd_list)
+    if size == 0:
+        return
+    nums = np.array(num_list, dtype=np.int64)
+    probs = np.array(prob_list, dtype=np.float64)
+    ranks = np.array(rank_list, dtype=np.float64)
+    # huge ranks (e.g., 10 ** 50 for the uncracked) are sorted and adjusted with python numbers,
+    # because int 10 ** 50 and float 10 ** 50 are not the same rank
+    huge = ranks >= 2.0 ** 53
+    order = np.flatnonzero(~huge)
+    order = order[np.argsort(ranks[order], kind='stable')]
+    order = order.tolist() + sorted(np.flatnonzero(huge).tolist(), key=lambda i: rank_list[i])
+    pwds = [pwd_list[i] for i in order]
+    nums, probs, ranks = nums[order], probs[order], ranks[order]
+    cracked = np.cumsum(nums)
+    total = cracked[-1]
+    percents = cracked / total * 100
+    # rank_i = max(round(rank_i), rank_{i-1} + 1) equals i + max(0, max_{j <= i} (round(rank_j) - j))
+    n_exact = size - int(np.count_nonzero(huge))
+    idx = np.arange(1, n_exact + 1, dtype=np.int64)
+    adjusted = idx + np.maximum(np.maximum.accumulate(np.rint(ranks[:n_exact]).astype(np.int64) - idx), 0)
+    adjusted = adjusted.tolist()
+    prev_rank = adjusted[-1] if n_exact > 0 else 0
+    for i in order[n_exact:]:
+        prev_rank = round(max(rank_list[i], prev_rank + 1))
+        adjusted.append(prev_rank)
+    out = []
+    for pwd, prob, num, rank, cracked_i, percent in \
+            zip(pwds, probs.tolist(), nums.tolist(), adjusted, cracked.tolist(), percents.tolist()):
+        out.append(f"{pwd}\t{prob}\t{num}\t{rank}\t{cracked_i}\t{percent:5.2f}\n")
+        if len(out) >= flush_every:
+            save2.writelines(out)
+            out.clear()
+    save2.writelines(out)
 
 
 def main():
     cli = argparse.ArgumentParser("Monte Carlo 2015 results converter")
-    cli.add_argument("-r", "--ranked", dest="ranked", required=True, type=argparse.FileType("r"),
+    cli.add_argument("-r", "--ranked", dest="ranked", required=True, type=argparse.FileType("rb"),
                      help="result generated by Monte Carlo 2015")
-    cli.add_argument("-s", "--save", dest="save", required=True, type=argparse.FileType("w"),
-                     help="save converted file here")
+    cli.add_argument("-s", "--save", dest="save", required=True,
+                     type=argparse.FileType("w", bufsize=1 << 20, errors='surrogateescape'),
+                     help="save converted file here, undecodable bytes of passwords are written as they are")
     cli.add_argument("-t", "--test", dest="fd_test_set", required=True, type=argparse.FileType('r'),
                      help="test set")
     cli.add_argument("--skip", dest="skip", required=False, type=int, default=0, help="skip first N lines")
@@ -2,66 +2,174 @@
 We will mask some characters/chunks in passwords
 """
 import argparse
-import bisect
 import math
+import multiprocessing
 import os.path
 import pickle
 import random
 import sys
 from collections import defaultdict
-from functools import reduce
-from typing import Callable, List, Dict, Set, Tuple
+from functools import lru_cache
+from operator import methodcaller
+from typing import Callable, List, Dict, Set, Tuple, Iterable, Sequence, Union, Optional
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def read_lines(password_file: str, chunk_size: int = 64 << 20):
+    """
+    Read the file in large chunks instead of line by line
+
+    :param password_file: file containing passwords per line
+    :param chunk_size: number of characters to read at a time
+    :return: generator of lists of lines, without line breaks
+    """
+    with open(password_file, 'r', buffering=1 << 20) as fin:
+        rest = ''
+        while True:
+            chunk = fin.read(chunk_size)
+            if not chunk:
+                break
+            # newlines are translated to '\n' in text mode, and str.splitlines would also split on '\x0b' etc.
+            lines = (rest + chunk).split('\n')
+            rest = lines.pop()
+            yield lines
+        if rest:
+            yield [rest]
 
 
 # @profile
-def read_passwords(password_file: str, line_splits: Callable[[str], List[str]], is_valid: Callable[[str], bool]) \
-        -> Dict[int, List[List[str]]]:
+def read_passwords(password_file: str, line_splits: Optional[Callable[[str], Sequence[str]]],
+                   is_valid: Callable[[str], bool]) -> Dict[int, List[Sequence[str]]]:
     """
 
     :param password_file: file containing passwords per line
-    :param line_splits: split passwords into one or several items (i.e., characters or chunks)
+    :param line_splits: split passwords into one or several items (i.e., characters or chunks),
+        None to keep each password as a str of characters
     :param is_valid: is the line a valid password
-    :return: passwords, each password is a list
+    :return: passwords, each password is a list or a str
     """
-    line_dict = defaultdict(int)
+    seen = set()
+    passwords_per_len = defaultdict(list)
     total_pwd = 0
     valid_pwd = 0
-    with open(password_file, 'r') as fin:
-        for line in fin:
-            line = line.strip('\r\n')
-            total_pwd += 1
+    for lines in read_lines(password_file):
+        total_pwd += len(lines)
+        new_lines = []
+        for line in lines:
             if not is_valid(line):
                 continue
             valid_pwd += 1
-            line_dict[line] += 1
-            pass
-        pass
+            if line in seen:
+                continue
+            seen.add(line)
+            new_lines.append(line)
+        if line_splits is None:
+            for line in new_lines:
+                passwords_per_len[len(line)].append(line)
+        else:
+            for pwd in map(line_splits, new_lines):
+                passwords_per_len[len(pwd)].append(pwd)
     print(f"total passwords: {total_pwd}, valid passwords: {valid_pwd}", file=sys.stderr)
-    passwords_per_len = defaultdict(list)
-    for line, _ in line_dict.items():
-        pwd = line_splits(line)
-        passwords_per_len[len(pwd)].append(pwd)
     return passwords_per_len
 
 
+@lru_cache(maxsize=None)
 def comb(n, m):
-    large, small = max(m, n - m), min(m, n - m)
-    prod = reduce(lambda x, y: x * y, list(range(large + 1, n + 1)), 1)
-    d = reduce(lambda x, y: x * y, list(range(2, small + 1)), 1)
+    return math.comb(n, m)
 
-    return prod // d
 
+def num_masked_probs(n: int, p: float, min_masked: int, max_masked: int) -> np.ndarray:
+    """
+    Each item is masked with probability `p`, and the number of masked items is limited to [min_masked, max_masked]
 
-# @profile
-def masking(passwords: List[List[str]], p: float, min_visible: int, min_masked: int,
-            num_masked_prob_cache: Dict[int, List[float]], mask='\t', dup_factor: int = 1,
-            cleanup: int = 100000, threshold4cleanup: int = 1) \
-        -> Dict[Tuple, Set[Tuple]]:
-    pwd_mask_dict = {}
-    cleanup = math.ceil(cleanup // dup_factor)
-    cur_round = 0
-    total_passwords = len(passwords)
-    cur_pwd_idx = 0
+    :return: cumulative probabilities of masking `min_masked`, `min_masked + 1`, ..., `max_masked` items
+    """
+    ms = np.arange(min_masked, max_masked + 1)
+    weights = np.array([comb(n, m) for m in ms.tolist()], dtype=np.float64) * np.power(p, ms) * np.power(1 - p, n - ms)
+    cum = np.cumsum(weights)
+    return cum / cum[-1]
+
+
+def _sample_masks_np(cum: np.ndarray, n: int, min_masked: int, dup: int) -> np.ndarray:
+    """
+    Sample `dup` masks for a password with `n` items
+
+    :param cum: cumulative probabilities of masking `min_masked`, `min_masked + 1`, ... items
+    :param n: number of items in the password
+    :param min_masked: minimum number of masked items
+    :param dup: number of masks to sample
+    :return: matrix with shape (dup, n), 1 refers to the item is masked
+    """
+    # draw the number of masked items for all duplications at once (same as bisect_right)
+    ms = min_masked + np.searchsorted(cum, np.random.random(dup), side='right')
+    # positions ranked lower than `m` in a random permutation are a uniformly chosen subset of size `m`
+    ranks = np.argsort(np.argsort(np.random.random((dup, n)), axis=1), axis=1)
+    return (ranks < ms[:, None]).astype(np.uint8)
+
+
+def _sample_masks_nb(cum: np.ndarray, n: int, min_masked: int, dup: int) -> np.ndarray:
+    """
+    Same as `_sample_masks_np`, written as plain loops to be compiled by numba
+    """
+    out = np.zeros((dup, n), np.uint8)
+    perm = np.arange(n)
+    for d in range(dup):
+        m = min_masked + np.searchsorted(cum, np.random.random(), side='right')
+        # sample the masked positions, or the visible positions if they are fewer
+        if 2 * m <= n:
+            k, flag = m, 1
+        else:
+            k, flag = n - m, 0
+            out[d, :] = 1
+        # partial Fisher-Yates shuffle, the first `k` items of `perm` are the sampled positions
+        for i in range(k):
+            j = np.random.randint(i, n)
+            perm[i], perm[j] = perm[j], perm[i]
+            out[d, perm[i]] = flag
+    return out
+
+
+def _seed_masks(seed: int):
+    np.random.seed(seed)
+
+
+if njit is not None:
+    sample_masks = njit(cache=True)(_sample_masks_nb)
+    # numba keeps its own random state, which has to be seeded inside compiled code
+    seed_masks = njit(cache=True)(_seed_masks)
+else:
+    sample_masks = _sample_masks_np
+    seed_masks = _seed_masks
+
+
+def decode_masked(masked_pwd: Union[bytes, Tuple]) -> Tuple:
+    """
+    Convert a masked password generated from a str password back to a tuple of characters
+    """
+    if isinstance(masked_pwd, bytes):
+        return tuple(masked_pwd.decode('utf-32-le'))
+    return masked_pwd
+
+
+def iter_masks(passwords: List[Sequence[str]], p: float, min_visible: int, min_masked: int,
+               num_masked_prob_cache: Dict[int, np.ndarray], mask='\t', dup_factor: int = 1, seed: int = 0):
+    """
+    Generate the masked passwords of each password.
+    The same `seed` generates the same masked passwords, so that we can go through them again.
+    A password is a list of items, or a str whose characters are the items.
+    Str passwords are masked as arrays of code points, and their masked passwords are the raw bytes of the arrays,
+    use `decode_masked` to obtain tuples of characters
+
+    :return: generator of (password, set of masked passwords)
+    """
+    seed_masks(seed)
+    mask_code = np.uint32(ord(mask)) if len(mask) == 1 else None
     for pwd in passwords:
         n = len(pwd)
         max_masked = n - min_visible
@@ -69,57 +177,165 @@ def masking(passwords: List[List[str]], p: float, min_visible: int, min_masked:
             raise Exception(f"The password should have at least {min_visible + min_masked} items, "
                             f"but {len(pwd)}: {pwd}")
             pass
-        if n not in num_masked_prob_cache:
-            prob_list = []
-            total = 0
-            for m in range(min_masked, max_masked + 1):
-                c = comb(n, m)
-                total += c * math.pow(p, m) * math.pow(1 - p, n - m)
-                prob_list.append(total)
-            prob_list = [prob / total for prob in prob_list]
-            num_masked_prob_cache[n] = prob_list
-            pass
-        dup = dup_factor
-        for _ in range(dup):
-            idx = bisect.bisect_right(num_masked_prob_cache[n], random.random())
-            m = min_masked + idx
-            is_masks = [True] * m + [False] * (n - m)
-            random.shuffle(is_masks)
-            masked_pwd = tuple(mask if is_mask else item for item, is_mask in zip(pwd, is_masks))
-            # print(masked_pwd)
-            if masked_pwd not in pwd_mask_dict:
-                pwd_mask_dict[masked_pwd] = set()
-            pwd_mask_dict[masked_pwd].add(tuple(pwd))
+        cum = num_masked_prob_cache.get(n)
+        if cum is None:
+            cum = num_masked_probs(n, p, min_masked=min_masked, max_masked=max_masked)
+            num_masked_prob_cache[n] = cum
             pass
+        is_masks = sample_masks(cum, n, min_masked, dup_factor)
+        if isinstance(pwd, str) and mask_code is not None:
+            codes = np.frombuffer(pwd.encode('utf-32-le'), dtype=np.uint32)
+            buf = np.where(is_masks, mask_code, codes).tobytes()
+            step = 4 * n
+            masked_pwds = {buf[i:i + step] for i in range(0, len(buf), step)}
+        else:
+            masked_pwds = {tuple(mask if is_mask else item for item, is_mask in zip(pwd, row))
+                           for row in is_masks.tolist()}
+        yield pwd, masked_pwds
+
+
+def iter_cleanups(masks: Iterable[Tuple[Sequence[str], Set]], total_passwords: int, cleanup: int,
+                  dup_factor: int = 1):
+    """
+    Mark the passwords after which templates are cleaned up.
+    `masking` and `collect_origins` share it, so that both of them clean up after the same passwords
+
+    :param masks: generator of (password, set of masked passwords), see `iter_masks`
+    :param total_passwords: number of passwords, templates are always cleaned up after the last one
+    :return: generator of (password, set of masked passwords, number of passwords so far, clean up or not)
+    """
+    cleanup = math.ceil(cleanup // dup_factor)
+    cur_round = 0
+    for cur_pwd_idx, (pwd, masked_pwds) in enumerate(masks, 1):
         cur_round += 1
-        cur_pwd_idx += 1
-        if cur_round >= cleanup or cur_pwd_idx == total_passwords:
+        need_cleanup = cur_round >= cleanup or cur_pwd_idx == total_passwords
+        if need_cleanup:
+            cur_round = 0
+        yield pwd, masked_pwds, cur_pwd_idx, need_cleanup
+
+
+# @profile
+def masking(passwords: List[Sequence[str]], p: float, min_visible: int, min_masked: int,
+            num_masked_prob_cache: Dict[int, np.ndarray], mask='\t', dup_factor: int = 1,
+            cleanup: int = 100000, threshold4cleanup: int = 1, seed: int = 0) \
+        -> Dict[Tuple, int]:
+    """
+    Count the passwords corresponding to each masked password (template).
+    Use `collect_origins` with the same parameters to obtain the passwords themselves
+
+    :return: dict of masked password and the number of its corresponding passwords
+    """
+    pwd_mask_dict = defaultdict(int)
+    total_passwords = len(passwords)
+    masks = iter_masks(passwords, p=p, min_visible=min_visible, min_masked=min_masked,
+                       num_masked_prob_cache=num_masked_prob_cache, mask=mask, dup_factor=dup_factor, seed=seed)
+    for _, masked_pwds, cur_pwd_idx, need_cleanup in iter_cleanups(masks, total_passwords=total_passwords,
+                                                                   cleanup=cleanup, dup_factor=dup_factor):
+        for masked_pwd in masked_pwds:
+            pwd_mask_dict[masked_pwd] += 1
+            pass
+        if need_cleanup:
             origin_len = len(pwd_mask_dict)
-            # cleanup keys whose corresponding values have at most five items.
-            for masked_pwd in list(pwd_mask_dict.keys()):
-                if len(pwd_mask_dict[masked_pwd]) <= threshold4cleanup:
-                    del pwd_mask_dict[masked_pwd]
-                pass
+            # cleanup keys whose corresponding values have at most `threshold4cleanup` items.
+            # rebuilding the dict is a single scan, and avoids the dummy entries left by deleting keys one by one
+            pwd_mask_dict = defaultdict(int, {masked_pwd: cnt for masked_pwd, cnt in pwd_mask_dict.items()
+                                              if cnt > threshold4cleanup})
             print(
                 f"[{cur_pwd_idx / total_passwords * 100:5.2f}%] "
                 f"Cleaning up from {origin_len:8,} to {len(pwd_mask_dict):8,} templates",
                 end='\r', file=sys.stderr)
-            cur_round = 0
             pass
         pass
     print(" " * 80, end='\r', file=sys.stderr)
     return pwd_mask_dict
 
 
+def collect_origins(passwords: List[Sequence[str]], templates: Iterable[Tuple], p: float, min_visible: int,
+                    min_masked: int, num_masked_prob_cache: Dict[int, np.ndarray], mask='\t', dup_factor: int = 1,
+                    cleanup: int = 100000, threshold4cleanup: int = 1, seed: int = 0) -> Dict[Tuple, Set[Tuple]]:
+    """
+    Go through the masked passwords generated by `masking` again, and collect the passwords of the given templates.
+    Cleanups of `masking` are replayed as well, so the number of passwords of a template equals its count.
+    Note that the parameters should be the same as those of `masking`
+
+    :return: dict of masked password and its corresponding passwords
+    """
+    pwd_mask_dict = {template: set() for template in templates}
+    masks = iter_masks(passwords, p=p, min_visible=min_visible, min_masked=min_masked,
+                       num_masked_prob_cache=num_masked_prob_cache, mask=mask, dup_factor=dup_factor, seed=seed)
+    for pwd, masked_pwds, _, need_cleanup in iter_cleanups(masks, total_passwords=len(passwords),
+                                                           cleanup=cleanup, dup_factor=dup_factor):
+        for masked_pwd in masked_pwds:
+            origins = pwd_mask_dict.get(masked_pwd)
+            if origins is not None:
+                origins.add(tuple(pwd))
+        if need_cleanup:
+            # `masking` drops these templates here, and counts them from scratch if they appear again
+            for origins in pwd_mask_dict.values():
+                if len(origins) <= threshold4cleanup:
+                    origins.clear()
+    return pwd_mask_dict
+
+
 def save_templates(templates_dict: Dict[str, Set], save: str):
     n_dict = {}
     for cls_name, templates in templates_dict.items():
         n_dict[cls_name] = templates
-    with open(save, 'wb') as f_save:
-        pickle.dump(n_dict, f_save)
+    with open(save, 'wb', buffering=1 << 20) as f_save:
+        pickle.dump(n_dict, f_save, protocol=pickle.HIGHEST_PROTOCOL)
     pass
 
 
+def _process_len(pwd_len: int, passwords: List[Sequence[str]], params: Dict) -> Optional[Tuple[str, str]]:
+    """
+    Mask the passwords with `pwd_len` items, group the templates into classes and save them.
+    Passwords of different lengths are independent, so this function may run in worker processes
+
+    :param pwd_len: number of items of the passwords
+    :param passwords: passwords with `pwd_len` items
+    :param params: options of `masking`, classes of templates and the output folder
+    :return: names of the saved files, None if nothing is saved
+    """
+    p, min_visible, min_masked, mask = params['p'], params['min_visible'], params['min_masked'], params['mask']
+    dup_factor, output = params['dup_factor'], params['output']
+    print(f"Parsing {len(passwords):10,} passwords with {pwd_len:2} items\r")
+    # each length has its own random state, no matter which process handles it
+    seed = (params['base_seed'] + pwd_len) % (1 << 32)
+    random.Random(seed).shuffle(passwords)
+    num_masked_prob_cache = {}
+    pwd_mask_dict = masking(
+        passwords=passwords, p=p, min_visible=min_visible, min_masked=min_masked,
+        num_masked_prob_cache=num_masked_prob_cache, mask=mask, dup_factor=dup_factor,
+        cleanup=params['cleanup'], threshold4cleanup=params['threshold4cleanup'], seed=seed,
+    )
+    templates_dict = defaultdict(set)
+    for masked_pwd, origins in pwd_mask_dict.items():
+        for cls_name, (lower_bound, upper_bound) in params['classes']:
+            if lower_bound <= origins <= upper_bound:
+                templates_dict[cls_name].add(decode_masked(masked_pwd))
+                break
+    for cls_name, templates in templates_dict.items():
+        print(f"{cls_name:>12}: {len(templates):>6,}")
+    if output == '':
+        return None
+    # only the templates left after cleanup need their passwords
+    pwd_mask_dict = collect_origins(
+        passwords=passwords, templates=pwd_mask_dict.keys(), p=p, min_visible=min_visible,
+        min_masked=min_masked, num_masked_prob_cache=num_masked_prob_cache, mask=mask, dup_factor=dup_factor,
+        cleanup=params['cleanup'], threshold4cleanup=params['threshold4cleanup'], seed=seed,
+    )
+    pwd_mask_dict = {decode_masked(masked_pwd): origins for masked_pwd, origins in pwd_mask_dict.items()}
+    pwd_mask_file = f"pwd_mask_dict_{pwd_len}.pickle"
+    template_file = f"template_dict_{pwd_len}.pickle"
+    pwd_mask_path = os.path.join(output, pwd_mask_file)
+    template_path = os.path.join(output, template_file)
+    with open(pwd_mask_path, 'wb', buffering=1 << 20) as f_out:
+        pickle.dump(pwd_mask_dict, f_out, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(template_path, 'wb', buffering=1 << 20) as f_template:
+        pickle.dump(templates_dict, f_template, protocol=pickle.HIGHEST_PROTOCOL)
+    return pwd_mask_file, template_file
+
+
 # @profile
 def wrapper():
     cli = argparse.ArgumentParser("Masking passwords", description="""
@@ -154,75 +370,61 @@ def wrapper():
                           '(depending on the `--threshold4cleanup` option)')
     cli.add_argument("--threshold4cleanup", dest='threshold4cleanup', default=1, type=int, required=False,
                      help='remove the template if its corresponding passwords is no more than `threshold4cleanup`')
+    cli.add_argument("--processes", dest="processes", default=os.cpu_count(), type=int, required=False,
+                     help='number of processes masking passwords of different lengths in parallel. '
+                          'Memory usage grows with it, set it to 1 to parse one length at a time')
     args = cli.parse_args()
     pwd_file, splitter, p, (min_visible, min_masked), length_upper_bound, num_samples = \
         args.input, args.splitter.lower(), args.prob, args.constrains, args.length_bound, args.num_samples
     output, mask, dup_factor = args.output, args.mask, args.dup_factor
-    cleanup, threshold4cleanup = args.cleanup, args.threshold4cleanup
+    cleanup, threshold4cleanup, processes = args.cleanup, args.threshold4cleanup, args.processes
     length_lower_bound = min_masked + min_visible
 
     if output == '':
         print(f"\033[1;31;40m"
               f"Note that the `-o` option does not exist. Therefore we'll not save the results."
               f"\033[0m", file=sys.stderr)
+    # builtins are used to split lines, which avoids calling a python function per password
     if splitter == 'empty':
-        def line_splits(line: str):
-            return list(line)
+        # characters of str passwords are masked directly, see `iter_masks`
+        line_splits = None if len(mask) == 1 else list
     else:
         splitter = {'space': ' ', 'tab': '\t'}.get(splitter, splitter)
-
-        def line_splits(line: str):
-            return line.split(splitter)
+        line_splits = methodcaller('split', splitter)
 
     def is_valid(line: str):
         return length_lower_bound <= len(line) <= length_upper_bound
 
     passwords_per_len = read_passwords(password_file=pwd_file, line_splits=line_splits, is_valid=is_valid)
-    num_masked_prob_cache = {}
     classes = [
         ('super-rare', [1, 5]),
         ('rare', [10, 15]),
         ('uncommon', [50, 150]),
         ('common', [1000, 15000])
     ]
-    if output != '' and not os.path.exists(output):
-        os.mkdir(output)
-    exist = os.path.exists(output)
+    exist = output != ''
+    if exist:
+        os.makedirs(output, exist_ok=True)
+    params = dict(p=p, min_visible=min_visible, min_masked=min_masked, mask=mask, dup_factor=dup_factor,
+                  cleanup=cleanup, threshold4cleanup=threshold4cleanup, classes=classes, output=output,
+                  base_seed=random.randrange(1 << 32))
+    tasks = [(pwd_len, passwords, params) for pwd_len, passwords in sorted(passwords_per_len.items())]
+    del passwords_per_len
+    if processes > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(processes, len(tasks))) as pool:
+            results = pool.starmap(_process_len, tasks)
+    else:
+        # drop each bucket of passwords as soon as it is parsed
+        results = [_process_len(*tasks.pop(0)) for _ in range(len(tasks))]
     pwd_mask_list, template_list = [], []
-    for pwd_len, passwords in sorted(passwords_per_len.items(), key=lambda x: x[0]):
-        print(f"Parsing {len(passwords):10,} passwords with {pwd_len:2} items\r")
-        random.shuffle(passwords)
-        pwd_mask_dict = masking(
-            passwords=passwords, p=p, min_visible=min_visible, min_masked=min_masked,
-            num_masked_prob_cache=num_masked_prob_cache, mask=mask, dup_factor=dup_factor,
-            cleanup=cleanup, threshold4cleanup=threshold4cleanup,
-        )
-        del passwords
-        templates_dict = {}
-        for masked_pwd, origins in pwd_mask_dict.items():
-            for cls_name, (lower_bound, upper_bound) in classes:
-                if lower_bound <= len(origins) <= upper_bound:
-                    if cls_name not in templates_dict:
-                        templates_dict[cls_name] = set()
-                    templates_dict[cls_name].add(masked_pwd)
-                    break
-        for cls_name, templates in templates_dict.items():
-            print(f"{cls_name:>12}: {len(templates):>6,}")
-        if exist:
-            pwd_mask_file = f"pwd_mask_dict_{pwd_len}.pickle"
-            template_file = f"template_dict_{pwd_len}.pickle"
-            with open(os.path.join(output, pwd_mask_file), 'wb') as f_out:
-                pickle.dump(pwd_mask_dict, f_out)
-            with open(os.path.join(output, template_file), 'wb') as f_template:
-                pickle.dump(templates_dict, f_template)
+    for saved in results:
+        if saved is not None:
+            pwd_mask_file, template_file = saved
             pwd_mask_list.append(pwd_mask_file)
             template_list.append(template_file)
-
-        del pwd_mask_dict
-        del templates_dict
     if exist and len(pwd_mask_list) > 0:
         with open(os.path.join(output, "file_list.pickle"), 'wb') as f_list:
-            pickle.dump((pwd_mask_list, template_list), f_list)
+            pickle.dump((pwd_mask_list, template_list), f_list, protocol=pickle.HIGHEST_PROTOCOL)
     pass
 
 
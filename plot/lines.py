@@ -26,22 +26,40 @@ python3 lines.py \
     -s savefig.pdf
 """
 import argparse
+import copy
+import hashlib
 import json
+import mmap
 import os
-
-import pickle
 import sys
-from collections import defaultdict
-from typing import TextIO, List, Any, Dict
+from itertools import groupby
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import BinaryIO, List, Any, Dict, Tuple, Optional
+
+import numpy as np
+import matplotlib
 
+# figures are only saved to files, a GUI backend is never needed unless EASYPWD_BACKEND asks for one.
+# savefig still picks the pdf/svg canvas by the suffix, Agg is used for png
+matplotlib.use(os.environ.get('EASYPWD_BACKEND', 'Agg'))
 import matplotlib.pyplot as plt
 from matplotlib.artist import Artist
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 from matplotlib.legend_handler import HandlerTuple
-import matplotlib
 from matplotlib.patches import Patch
+from matplotlib.ticker import FuncFormatter, MaxNLocator
 from mpl_toolkits.axes_grid1.inset_locator import mark_inset
 
-matplotlib.rcParams['pdf.fonttype'] = 42
+try:
+    # orjson is several times faster than the json module on the long x_list and y_list
+    from orjson import loads as json_loads
+except ImportError:
+    try:
+        from ujson import loads as json_loads
+    except ImportError:
+        from json import loads as json_loads
 
 
 def conf_font(font_name):
@@ -145,6 +163,14 @@ class PlotParams:
         self.fig_size = args.fig_size
         self.no_boarder = args.no_boarder
         self.show_text = args.show_text
+        self.max_points = args.max_points
+        self.downsample = args.downsample
+        self.prelog_x = args.prelog_x
+        self.fast = args.fast
+        # long curves are embedded as images in vector outputs (pdf, svg), while axes and texts are still vectors
+        self.rasterize_lines = not args.no_rasterize
+        self.raster_points = args.raster_points
+        self.raster_dpi = args.raster_dpi
 
         if not (len(self.vlines) == len(self.vline_width) == len(self.vline_color) == len(self.vlines)):
             print(f"vlines should have same number of parameters", file=sys.stderr)
@@ -165,152 +191,1011 @@ class PlotParams:
         self.sub_params = SubParams(args)
 
 
+class LazyPatches:
+    def __init__(self, pickle_file: str):
+        """
+        The patches in the pickle file, which are loaded the first time they are iterated.
+        patch.py writes patches one by one, while older files contain one list of patches
+        :param pickle_file: pickle file which contains patches
+        """
+        self.pickle_file = pickle_file
+        self.patches = None
+
+    def load(self) -> List[Any]:
+        if self.patches is None:
+            # pickle is only needed when --patches is used
+            import pickle
+            try:
+                patches = []
+                with open(self.pickle_file, 'rb') as fin:
+                    # patch.py without any command writes an empty file, which cannot be mmapped
+                    if os.fstat(fin.fileno()).st_size > 0:
+                        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                            while mm.tell() < mm.size():
+                                # each record is written with a cleared memo, so it needs a fresh unpickler
+                                obj = pickle.load(mm)
+                                if isinstance(obj, list):
+                                    patches.extend(obj)
+                                else:
+                                    patches.append(obj)
+                self.patches = patches
+            except Exception as e:
+                print(e, file=sys.stderr)
+                sys.exit(-1)
+        return self.patches
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+
+# parsed json files, so that drawing the same file again in this process skips parsing it
+_parsed_json: Dict[Any, Dict[Any, Any]] = {}
+# parse json files in processes if they are larger than this in total
+parallel_parse_bytes = 32 << 20
+# buffer size of json files opened by -f, they are often several MB of numbers
+json_buffer_size = 1 << 20
+
+
+def read_json(json_file: BinaryIO, close_fd: bool) -> Tuple[Any, Any]:
+    """
+    Read the whole json file at once, but skip files which are parsed before.
+    Regular files are identified by their real paths, modification time and size
+    :param json_file: json file
+    :param close_fd: close json file, otherwise rewind it if possible
+    :return: (key, content), content is None if the file is cached
+    """
+    key = None
+    name = getattr(json_file, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        stat = os.fstat(json_file.fileno())
+        key = (os.path.realpath(name), stat.st_mtime_ns, stat.st_size)
+    content = None if key in _parsed_json else json_file.read()
+    if close_fd:
+        json_file.close()
+    elif json_file.seekable():
+        json_file.seek(0)
+    return key, content
+
+
+def parse_json(content: Any) -> Dict[Any, Any]:
+    """
+    Parse the json and convert x_list and y_list to float64 ndarrays,
+    which are also much cheaper to send back from a worker process than lists of floats
+    :param content: content of json file
+    :return: parsed json
+    """
+    try:
+        data = json_loads(content)
+    except ValueError:
+        # orjson and ujson reject NaN and Infinity, which json.dump writes by default
+        data = json.loads(content)
+    for k in ("x_list", "y_list"):
+        if k in data:
+            data[k] = np.asarray(data[k], dtype=np.float64)
+    return data
+
+
+def sidecar_path(content: Any, cache_dir: str) -> str:
+    """
+    :param content: content of json file
+    :param cache_dir: folder of cached files
+    :return: path of the npz file for this content
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    key = hashlib.blake2b(content, digest_size=16).hexdigest()
+    return os.path.join(cache_dir, f"{key}.npz")
+
+
+def load_sidecar(path: str) -> Optional[Dict[Any, Any]]:
+    """
+    :param path: npz file saved by save_sidecar
+    :return: parsed json, None if the file is missing or broken
+    """
+    try:
+        with np.load(path) as npz:
+            data = json.loads(str(npz["meta"]))
+            data["x_list"] = npz["x_list"]
+            data["y_list"] = npz["y_list"]
+            return data
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def save_sidecar(path: str, data: Dict[Any, Any]):
+    """
+    Save x_list and y_list as arrays, and other attributes as a json string.
+    Failing to save is not an error, the json file will be parsed again next time
+    :param path: npz file
+    :param data: parsed json
+    """
+    if "x_list" not in data or "y_list" not in data:
+        return
+    meta = {k: v for k, v in data.items() if k not in ("x_list", "y_list")}
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, 'wb') as fout:
+            # not compressed, compressing takes longer than parsing the json file again
+            np.savez(fout, x_list=data["x_list"], y_list=data["y_list"], meta=np.array(json.dumps(meta)))
+        os.replace(tmp, path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Failed to cache {path}: {e}", file=sys.stderr)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def load_json_files(json_files: List[BinaryIO], close_fd: bool = True,
+                    cache_dir: Optional[str] = None) -> List[Dict[Any, Any]]:
+    """
+    Read json files in threads, and parse them in processes if they are large
+    :param json_files: json files
+    :param close_fd: close json files
+    :param cache_dir: look for parsed json files here before parsing them, None to always parse
+    :return: parsed json files, in the same order as json_files
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(32, len(json_files)))) as executor:
+        raw = list(executor.map(lambda json_file: read_json(json_file, close_fd=close_fd), json_files))
+    pending = [content for _, content in raw if content is not None]
+    sidecars = [None] * len(pending) if cache_dir is None else [sidecar_path(c, cache_dir) for c in pending]
+    parsed = [None if sidecar is None else load_sidecar(sidecar) for sidecar in sidecars]
+    missing = [idx for idx, data in enumerate(parsed) if data is None]
+    if len(missing) > 1 and sum(len(pending[idx]) for idx in missing) >= parallel_parse_bytes:
+        with ProcessPoolExecutor(max_workers=max(1, min(os.cpu_count() or 1, len(missing)))) as executor:
+            missing_parsed = list(executor.map(parse_json, [pending[idx] for idx in missing]))
+    else:
+        missing_parsed = [parse_json(pending[idx]) for idx in missing]
+    for idx, data in zip(missing, missing_parsed):
+        parsed[idx] = data
+        if sidecars[idx] is not None:
+            save_sidecar(sidecars[idx], data)
+    parsed_iter = iter(parsed)
+    res = []
+    for key, content in raw:
+        if content is None:
+            res.append(_parsed_json[key])
+            continue
+        data = next(parsed_iter)
+        if key is not None:
+            _parsed_json[key] = data
+        res.append(data)
+    return res
+
+
 class LineParam:
-    def __init__(self, json_file: TextIO, close_fd: bool):
+    # attributes of a line and their default values
+    defaults = {
+        'color': "black",
+        'marker': None,
+        'marker_size': None,
+        'mark_every': None,
+        'line_width': 1.2,
+        'label': "",
+        'show_text': False,
+        'text_x': -1,
+        'text_y': -1,
+        'text_fontsize': 12,
+        'text_color': "black",
+        'show_label': False,
+    }
+
+    def __init__(self, data: Dict[Any, Any]):
         """
         Note that x_list, y_list and total are required, while others are optional
-        :param json_file: json file
-        :param close_fd: close json file
+        :param data: parsed json file
         """
-        data: Dict[Any, Any] = json.load(json_file)
-        y_list = data["y_list"]
+        # matplotlib takes ndarrays without converting them again
+        y_list = np.asarray(data["y_list"], dtype=np.float64)
         need_divide_total = data.get('need_divide_total', True)
-        if need_divide_total and data.get("total", -1) > 0:
-            total = data["total"]
-            y_list = [cracked / total * 100 for cracked in y_list]
-        if close_fd:
-            json_file.close()
-        elif json_file.seekable():
-            json_file.seek(0)
-        self.x_list = data["x_list"]
+        scale = 100.0 / data["total"] if need_divide_total and data.get("total", -1) > 0 else 1.0
+        if scale != 1.0:
+            # not in place, y_list may be the array kept in the cache of parsed json files
+            y_list = np.multiply(y_list, scale)
+        self.x_list = np.asarray(data["x_list"], dtype=np.float64)
         self.y_list = y_list
-        self.color = data.get('color') or "black"
-        self.marker = data.get('marker') or None
-        self.marker_size = data.get('marker_size') or None
-        self.mark_every = data.get("mark_every") or None
-        self.line_width = data.get('line_width') or 1.2
-        if data.get("line_style"):
-            if type(data['line_style']) is str:
-                self.line_style = data['line_style']
-            else:
-                self.line_style = (data['line_style'][0], tuple(list(data['line_style'][1])))
-        else:
+        for key, default in LineParam.defaults.items():
+            # only missing values and nulls use the defaults, 0, "" and false in json files are kept
+            value = data.get(key)
+            setattr(self, key, default if value is None else value)
+        line_style = data.get("line_style")
+        if not line_style:
             self.line_style = "-"
-        self.label = data.get('label') or ""
-        self.text = data.get('label') or ""
-        self.show_text = data.get('show_text') or False
-        self.text_x = data.get('text_x') or -1
-        self.text_y = data.get('text_y') or -1
-        self.text_fontsize = data.get('text_fontsize') or 12
-        self.text_color = data.get('text_color') or "black"
-        self.show_label = data.get('show_label') or False
-
-
-def curve(json_files: List[TextIO], plot_params: PlotParams, close_fd: bool = True):
-    fig = plt.figure(figsize=plot_params.fig_size)
-    fig.set_tight_layout(plot_params.tight_layout)
-    label_line = defaultdict(list)
-    ax = plt.gca()
-    inner = None
-    if plot_params.sub_params.use_inset_axes:
-        inner = ax.inset_axes(plot_params.sub_params.inset_axes)
+        elif type(line_style) is str:
+            self.line_style = line_style
+        else:
+            self.line_style = (line_style[0], tuple(list(line_style[1])))
+        self.text = self.label
+
+
+class LineSet:
+    def __init__(self, line_params_list: List[LineParam]):
+        """
+        Attributes of lines are stored as parallel lists, the i-th element of each list belongs to the i-th line.
+        Flags and widths are ndarrays, so that lines can be selected by numpy indexing
+        :param line_params_list: lines parsed from json files
+        """
+        self.xs = [line_params.x_list for line_params in line_params_list]
+        self.ys = [line_params.y_list for line_params in line_params_list]
+        self.colors = [line_params.color for line_params in line_params_list]
+        self.markers = [line_params.marker for line_params in line_params_list]
+        self.marker_sizes = [line_params.marker_size for line_params in line_params_list]
+        self.mark_everys = [line_params.mark_every for line_params in line_params_list]
+        self.line_widths = np.array([line_params.line_width for line_params in line_params_list], dtype=np.float64)
+        self.line_styles = [line_params.line_style for line_params in line_params_list]
+        self.labels = [line_params.label for line_params in line_params_list]
+        self.text_xs = [line_params.text_x for line_params in line_params_list]
+        self.text_ys = [line_params.text_y for line_params in line_params_list]
+        self.text_fontsizes = [line_params.text_fontsize for line_params in line_params_list]
+        self.text_colors = [line_params.text_color for line_params in line_params_list]
+        self.has_marker = np.array([marker not in (None, "", " ", "None", "none") for marker in self.markers],
+                                   dtype=bool)
+        self.show_texts = np.array([bool(line_params.show_text) for line_params in line_params_list], dtype=bool)
+        self.show_labels = np.array([bool(line_params.show_label) for line_params in line_params_list], dtype=bool)
+
+    def __len__(self):
+        return len(self.xs)
+
+    def many_points(self, max_points: int) -> np.ndarray:
+        """
+        :param max_points: lines with more points than it are flagged
+        :return: flags of lines
+        """
+        return np.array([len(x_list) > max_points for x_list in self.xs], dtype=bool)
+
+    def segments(self) -> List[np.ndarray]:
+        """
+        :return: (n, 2) arrays of points of each line, which is what LineCollection takes
+        """
+        return [np.column_stack([x_list, y_list]) for x_list, y_list in zip(self.xs, self.ys)]
+
+    def window(self, xmin: float, xmax: float, ymin: float, ymax: float) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """
+        Find lines which may be visible in the window, and drop their points far away from the window.
+        Bounds equal to the default values of --xlim-low and others are treated as unbounded
+        :param xmin: left of the window
+        :param xmax: right of the window
+        :param ymin: bottom of the window
+        :param ymax: top of the window
+        :return: indices of these lines, and their (n, 2) arrays of points
+        """
+        xmin = -np.inf if xmin == DefaultVal.lim_low else xmin
+        xmax = np.inf if xmax == DefaultVal.lim_high else xmax
+        ymin = -np.inf if ymin == DefaultVal.lim_low else ymin
+        ymax = np.inf if ymax == DefaultVal.lim_high else ymax
+        indices, segments = [], []
+        for idx, (x_list, y_list) in enumerate(zip(self.xs, self.ys)):
+            if len(x_list) > 1:
+                # keep both ends of the line segments whose x ranges overlap the window
+                crossing = (np.minimum(x_list[:-1], x_list[1:]) <= xmax) & \
+                           (np.maximum(x_list[:-1], x_list[1:]) >= xmin)
+                keep = np.zeros(len(x_list), dtype=bool)
+                keep[:-1] |= crossing
+                keep[1:] |= crossing
+                kept = np.flatnonzero(keep)
+                # points of unsorted x may be kept in several runs, joining them draws wrong segments
+                if len(kept) > 0 and kept[-1] - kept[0] + 1 == len(kept):
+                    x_list, y_list = x_list[kept[0]:kept[-1] + 1], y_list[kept[0]:kept[-1] + 1]
+                elif len(kept) == 0:
+                    continue
+            elif len(x_list) == 0 or not xmin <= x_list[0] <= xmax:
+                continue
+            # a line whose points are all below or all above the window does not cross it
+            if np.all(y_list < ymin) or np.all(y_list > ymax):
+                continue
+            indices.append(idx)
+            segments.append(np.column_stack([x_list, y_list]))
+        return np.array(indices, dtype=np.int64), segments
+
+
+def decimate(x_list: np.ndarray, y_list: np.ndarray, max_points: int, xscale: str):
+    """
+    Split the x axis (in log space if xscale is log) into `max_points // 2` bins,
+    and keep the first and the last points of each bin.
+    Curves drawn in a figure have far more points than pixels, and most of them overlap
+    :param x_list: x values, ascending
+    :param y_list: y values
+    :param max_points: keep at most this number of points, non-positive to keep all points
+    :param xscale: scale of x axis
+    :return: decimated x values and y values
+    """
+    size = len(x_list)
+    if max_points <= 0 or size <= max_points or np.any(np.diff(x_list) < 0):
+        return x_list, y_list
+    if xscale == 'log':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pos = np.log10(x_list)
+    else:
+        pos = x_list
+    finite = np.isfinite(pos)
+    if not np.any(finite):
+        return x_list, y_list
+    low, high = pos[finite].min(), pos[finite].max()
+    n_bins = max(1, max_points // 2)
+    width = (high - low) / n_bins or 1.0
+    # non-positive values on log scale fall into the first bin
+    bins = np.clip(np.floor((np.where(finite, pos, low) - low) / width), 0, n_bins - 1)
+    changes = np.flatnonzero(np.diff(bins))
+    keep = np.union1d(np.r_[0, changes + 1], np.r_[changes, size - 1])
+    return x_list[keep], y_list[keep]
+
+
+def clip_x(x_list: np.ndarray, y_list: np.ndarray, xmin: float, xmax: float):
+    """
+    Drop points out of [xmin, xmax], except the nearest one on each side so that lines still reach the borders.
+    Only ascending x values are clipped
+    :param x_list: x values
+    :param y_list: y values
+    :param xmin: left bound
+    :param xmax: right bound
+    :return: clipped x values and y values
+    """
+    if len(x_list) < 3 or np.any(np.diff(x_list) < 0):
+        return x_list, y_list
+    start = max(0, int(np.searchsorted(x_list, xmin, side='left')) - 1)
+    end = min(len(x_list), int(np.searchsorted(x_list, xmax, side='right')) + 1)
+    return x_list[start:end], y_list[start:end]
+
+
+def lttb(x_list: np.ndarray, y_list: np.ndarray, n_out: int, xscale: str):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    The first and last points are kept, and the others are split into `n_out - 2` buckets.
+    In each bucket, the point forming the largest triangle with the point chosen in the previous bucket
+    and the average of the next bucket is kept
+    :param x_list: x values, ascending
+    :param y_list: y values
+    :param n_out: keep this number of points
+    :param xscale: scale of x axis, triangles are measured in log space if it is log
+    :return: downsampled x values and y values
+    """
+    size = len(x_list)
+    if n_out < 3 or size <= n_out or np.any(np.diff(x_list) < 0):
+        return x_list, y_list
+    if xscale == 'log':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pos = np.log10(x_list)
+    else:
+        pos = x_list
+    if not np.all(np.isfinite(pos)) or not np.all(np.isfinite(y_list)):
+        return x_list, y_list
+    edges = np.linspace(1, size - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, size - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else size
+        avg_x, avg_y = pos[end:next_end].mean(), y_list[end:next_end].mean()
+        area = np.abs((pos[prev] - avg_x) * (y_list[start:end] - y_list[prev]) -
+                      (pos[prev] - pos[start:end]) * (avg_y - y_list[prev]))
+        prev = start + int(np.argmax(area))
+        keep[i + 1] = prev
+    return x_list[keep], y_list[keep]
+
+
+def build_line_set(line_data: List[Dict[Any, Any]], plot_params: PlotParams) -> LineSet:
+    """
+    :param line_data: parsed json files
+    :param plot_params: params of the figure
+    :return: lines to draw, long lines without markers are clipped by xlim and downsampled
+    """
+    line_set = LineSet([LineParam(data) for data in line_data])
+    # points out of xlim can be dropped only if all limits are given, otherwise they change the auto limits
+    xmin, xmax = -np.inf, np.inf
+    if DefaultVal.lim_low not in (plot_params.xlim_low, plot_params.ylim_low) and \
+            DefaultVal.lim_high not in (plot_params.xlim_high, plot_params.ylim_high):
+        xmin, xmax = plot_params.xlim_low, plot_params.xlim_high
+        if len(plot_params.xticks_val) > 0:
+            # x ticks out of xlim widen the x axis
+            xmin, xmax = min(xmin, min(plot_params.xticks_val)), max(xmax, max(plot_params.xticks_val))
+        sub_params = plot_params.sub_params
+        if sub_params.use_inset_axes:
+            # the inset axes may show points out of xlim
+            xmin = min(xmin, sub_params.xmin or xmin)
+            xmax = max(xmax, sub_params.xmax or xmax)
+    # twice the number of pixels of the figure in width
+    width_px = (plot_params.fig_size or matplotlib.rcParams['figure.figsize'])[0] * matplotlib.rcParams['figure.dpi']
+    n_lttb = int(2 * width_px) if plot_params.max_points <= 0 else min(int(2 * width_px), plot_params.max_points)
+    # markers are placed by indices of points, so lines with markers are kept as they are
+    for idx in np.flatnonzero(~line_set.has_marker):
+        x_list, y_list = line_set.xs[idx], line_set.ys[idx]
+        if np.isfinite(xmin) or np.isfinite(xmax):
+            x_list, y_list = clip_x(x_list, y_list, xmin=xmin, xmax=xmax)
+        if plot_params.downsample == 'lttb':
+            if len(x_list) > 2 * n_lttb:
+                x_list, y_list = lttb(x_list, y_list, n_out=n_lttb, xscale=plot_params.xscale)
+        else:
+            x_list, y_list = decimate(x_list, y_list, max_points=plot_params.max_points, xscale=plot_params.xscale)
+        line_set.xs[idx], line_set.ys[idx] = x_list, y_list
+    return line_set
+
+
+def log10_x(x_list: Any) -> Any:
+    """
+    :param x_list: x values, or one x value
+    :return: log10 of x values, non-positive values are nan
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.log10(np.where(np.asarray(x_list) > 0, x_list, np.nan))
+
+
+def prelog_params(plot_params: PlotParams) -> PlotParams:
+    """
+    Params to draw log10 of x values on a linear x axis, which looks the same as drawing x values on a log x axis,
+    but matplotlib does not transform all the points of lines whenever drawing them.
+    Inset axes and patches are in the coordinates of data and are not supported
+    :param plot_params: params of the figure with log x axis
+    :return: a copy of params with linear x axis and log10 of x limits, ticks and vlines
+    """
+    params = copy.copy(plot_params)
+    params.xscale = 'linear'
+
+    def log_lim(lim, default):
+        if lim == default:
+            return default
+        # log10 of a limit should not be mistaken for the default value
+        lim = float(log10_x(lim))
+        return np.nextafter(lim, 0.0) if lim == default else lim
+
+    params.xlim_low = log_lim(plot_params.xlim_low, DefaultVal.lim_low)
+    params.xlim_high = log_lim(plot_params.xlim_high, DefaultVal.lim_high)
+    params.xticks_val = [float(v) for v in log10_x(plot_params.xticks_val)] if len(plot_params.xticks_val) > 0 \
+        else plot_params.xticks_val
+    params.vlines = [float(v) for v in log10_x(plot_params.vlines)] if len(plot_params.vlines) > 0 \
+        else plot_params.vlines
+    return params
+
+
+class Plotter:
+    def __init__(self):
+        """
+        Draw figures one after another on the same Figure and Axes,
+        instead of creating and tearing down a figure for each of them
+        """
+        self.fig = None
+        self.ax = None
+        self.fig_size = None
+        # margins found by tight layout, figures with the same texts around the axes have the same margins
+        self.layouts = {}
+        # fingerprint of the figure drawn last, and its artists which depend on the data of lines
+        self.fingerprint = None
+        self.artists = None
+
+    def reset(self, fig_size: Any):
+        """
+        Clear the axes for the next figure, a new figure is created only if the size changes
+        :param fig_size: size of figure
+        :return: figure and axes
+        """
+        self.fingerprint, self.artists = None, None
+        if self.fig is not None and self.fig_size == fig_size:
+            # inset axes, legend and artists are removed by clear(), hidden boarders and margins are not
+            self.ax.clear()
+            for spine in self.ax.spines.values():
+                spine.set_color(matplotlib.rcParams['axes.edgecolor'])
+            self.fig.subplots_adjust(**{k: matplotlib.rcParams[f'figure.subplot.{k}']
+                                        for k in ('left', 'right', 'bottom', 'top', 'wspace', 'hspace')})
+        else:
+            self.close()
+            self.fig, self.ax = plt.subplots(figsize=fig_size)
+            self.fig_size = fig_size
+        return self.fig, self.ax
+
+    def layout_key(self, plot_params: PlotParams) -> Optional[Tuple]:
+        """
+        Everything that changes the size of texts around the axes.
+        Tick texts are only known before drawing if ticks are given, otherwise the layout is not cached.
+        Texts of lines and patches may also stick out of the axes, so layouts with them are not cached either
+        :param plot_params: params of the figure
+        :return: key of the layout, None if it should not be cached
+        """
+        if len(plot_params.xticks_val) == 0 or len(plot_params.yticks_val) == 0 or \
+                len(self.ax.texts) > 0 or len(plot_params.patches) > 0:
+            return None
+        legend = self.ax.get_legend()
+        return (plot_params.fig_size, tuple(matplotlib.rcParams['font.sans-serif']),
+                plot_params.xlabel, plot_params.xlabel_weight, plot_params.xlabel_size,
+                plot_params.ylabel, plot_params.ylabel_weight, plot_params.ylabel_size,
+                tuple(plot_params.xticks_val), tuple(plot_params.xticks_text),
+                tuple(plot_params.yticks_val), tuple(plot_params.yticks_text),
+                plot_params.tick_size, plot_params.xtick_direction, plot_params.ytick_direction,
+                self.ax.get_xlim(), self.ax.get_ylim(),
+                None if legend is None else (plot_params.legend_loc, plot_params.legend_fontsize,
+                                             tuple(text.get_text() for text in legend.get_texts())))
+
+    def figure_fingerprint(self, line_set: LineSet, plot_params: PlotParams) -> Optional[str]:
+        """
+        Everything of a figure except points of lines and the file to save.
+        Limits found by autoscale depend on the data, so only figures with all limits given are fingerprinted.
+        Inset axes, patches and texts of lines are not supported, since the layout has to fit them again
+        :param line_set: lines to draw
+        :param plot_params: params of the figure
+        :return: fingerprint of the figure, None if it should be drawn from scratch
+        """
+        if plot_params.sub_params.use_inset_axes or len(plot_params.patches) > 0 or \
+                (plot_params.show_text and line_set.show_texts.any()) or \
+                plot_params.xlim_low == DefaultVal.lim_low or plot_params.xlim_high == DefaultVal.lim_high or \
+                plot_params.ylim_low == DefaultVal.lim_low or plot_params.ylim_high == DefaultVal.lim_high:
+            return None
+        params = sorted((k, v) for k, v in vars(plot_params).items() if k not in ('save', 'sub_params', 'patches'))
+        styles = (line_set.colors, line_set.markers, line_set.marker_sizes, line_set.mark_everys,
+                  line_set.line_widths.tolist(), line_set.line_styles, line_set.labels,
+                  line_set.text_fontsizes, line_set.text_colors, line_set.has_marker.tolist(),
+                  line_set.show_texts.tolist(), line_set.show_labels.tolist(),
+                  line_set.many_points(plot_params.raster_points).tolist())
+        # values in json files may be lists, which are not hashable
+        return repr((params, styles, tuple(matplotlib.rcParams['font.sans-serif'])))
+
+    def update(self, line_set: LineSet):
+        """
+        Move the lines and markers of the figure drawn last to the points of these lines
+        :param line_set: lines of the same fingerprint as the figure drawn last
+        """
+        curves, marker_lines = self.artists
+        if isinstance(curves, LineCollection):
+            curves.set_segments(line_set.segments())
+        else:
+            for line, x_list, y_list in zip(curves, line_set.xs, line_set.ys):
+                line.set_data(x_list, y_list)
+        for idx, line in zip(np.flatnonzero(line_set.has_marker), marker_lines):
+            line.set_data(line_set.xs[idx], line_set.ys[idx])
         pass
-    for json_file in json_files:
-        line_params = LineParam(json_file=json_file, close_fd=close_fd)
-        line, = plt.plot(line_params.x_list, line_params.y_list, color=line_params.color,
-                         marker=line_params.marker, markersize=line_params.marker_size,
-                         markevery=line_params.mark_every, linewidth=line_params.line_width,
-                         linestyle=line_params.line_style, label=line_params.label)
+
+    def save(self, plot_params: PlotParams):
+        # dpi of vector outputs only applies to the rasterized curves
+        kwargs = {'dpi': plot_params.raster_dpi} \
+            if plot_params.rasterize_lines and not plot_params.save.endswith('.png') else {}
+        if plot_params.save.endswith('.pdf'):
+            # TrueType fonts are embedded in pdf files, the setting is only needed when saving them
+            with matplotlib.rc_context({'pdf.fonttype': 42}):
+                self.fig.savefig(plot_params.save, **kwargs)
+        else:
+            self.fig.savefig(plot_params.save, **kwargs)
+        pass
+
+    def close(self):
+        if self.fig is not None:
+            plt.close(self.fig)
+        self.fig, self.ax, self.fig_size = None, None, None
+        self.fingerprint, self.artists = None, None
+
+    def curve(self, line_data: List[Dict[Any, Any]], plot_params: PlotParams):
+        line_set = build_line_set(line_data, plot_params)
+        prelog_x = plot_params.prelog_x and plot_params.xscale == 'log' and \
+            not plot_params.sub_params.use_inset_axes and len(plot_params.patches) == 0
+        if prelog_x:
+            plot_params = prelog_params(plot_params)
+            line_set.xs = [log10_x(x_list) for x_list in line_set.xs]
+            line_set.text_xs = [log10_x(text_x) for text_x in line_set.text_xs]
+        fingerprint = self.figure_fingerprint(line_set, plot_params)
+        if fingerprint is not None and fingerprint == self.fingerprint:
+            # only the data changes, axes, ticks, legend and layout of the last figure are kept
+            self.update(line_set)
+            self.save(plot_params)
+            return
+        fig, ax = self.reset(plot_params.fig_size)
+        # (label, legend handle) of lines and vlines
+        label_lines = []
+        inner = None
+        if plot_params.sub_params.use_inset_axes:
+            inner = ax.inset_axes(plot_params.sub_params.inset_axes)
+            pass
+        # fields used several times below are looked up once
+        xscale, yscale = plot_params.xscale, plot_params.yscale
+        xlim_low, xlim_high = plot_params.xlim_low, plot_params.xlim_high
+        ylim_low, ylim_high = plot_params.ylim_low, plot_params.ylim_high
+        # only lines with many points after downsampling are rasterized, short lines are kept as vectors
+        rasterized = line_set.many_points(plot_params.raster_points) & plot_params.rasterize_lines
+        sub_params = plot_params.sub_params
+        if plot_params.legend_loc == 'best':
+            # the best location of legend only avoids Line2D but not LineCollection, so lines are drawn one by one
+            curves = [ax.plot(x_list, y_list, color=color, linewidth=line_width, linestyle=line_style,
+                              rasterized=bool(line_rasterized))[0]
+                      for x_list, y_list, color, line_width, line_style, line_rasterized in
+                      zip(line_set.xs, line_set.ys, line_set.colors, line_set.line_widths, line_set.line_styles,
+                          rasterized)]
+        else:
+            # all lines are drawn by a single collection, instead of one Line2D for each line
+            curves = LineCollection(line_set.segments(), colors=line_set.colors,
+                                    linewidths=line_set.line_widths, linestyles=line_set.line_styles,
+                                    rasterized=bool(rasterized.any()))
+            ax.add_collection(curves)
         if inner is not None:
-            inner.plot(line_params.x_list, line_params.y_list, color=line_params.color,
-                       marker=line_params.marker, markersize=line_params.marker_size,
-                       markevery=line_params.mark_every, linewidth=line_params.line_width,
-                       linestyle=line_params.line_style, label=line_params.label)
-        if plot_params.show_text and line_params.show_text:
-            plt.text(x=line_params.text_x, y=line_params.text_y, s=line_params.label,
-                     c=line_params.text_color, fontsize=line_params.text_fontsize)
-        if line_params.show_label:
-            label_line[line_params.label].append(line)
-        del line_params
-    plt.xscale(plot_params.xscale)
-    plt.yscale(plot_params.yscale)
-    if plot_params.xlim_low != DefaultVal.lim_low:
-        plt.xlim(left=plot_params.xlim_low)
-    if plot_params.xlim_high != DefaultVal.lim_high:
-        plt.xlim(right=plot_params.xlim_high)
-    if plot_params.ylim_low != DefaultVal.lim_low:
-        plt.ylim(bottom=plot_params.ylim_low)
-    if plot_params.ylim_high != DefaultVal.lim_high:
-        plt.ylim(top=plot_params.ylim_high)
-    plt.xlabel(xlabel=plot_params.xlabel,
-               fontdict={"weight": plot_params.xlabel_weight,
-                         "size": plot_params.xlabel_size})
-    plt.ylabel(ylabel=plot_params.ylabel,
-               fontdict={"weight": plot_params.ylabel_weight,
-                         "size": plot_params.ylabel_size})
-    if len(plot_params.yticks_val) != len(DefaultVal.empty_ticks):
-        plt.yticks(plot_params.yticks_val, plot_params.yticks_text)
-    if len(plot_params.xticks_val) != len(DefaultVal.empty_ticks):
-        plt.xticks(plot_params.xticks_val, plot_params.xticks_text)
-    # direction and size of ticks
-    plt.tick_params(axis='x', labelsize=plot_params.tick_size, direction=plot_params.xtick_direction)
-    plt.tick_params(axis='y', labelsize=plot_params.tick_size, direction=plot_params.ytick_direction)
-    plt.tick_params(axis='both', which='minor', length=0)
-    # v line
-    for vline_x, vline_width, vline_color, vline_style, vline_label in \
-            zip(plot_params.vlines, plot_params.vline_width,
-                plot_params.vline_color, plot_params.vline_style, plot_params.vline_label):
-        line = plt.axvline(x=vline_x, linewidth=vline_width, color=vline_color, linestyle=vline_style,
-                           label=vline_label)
+            # the inset only shows a small window, so only the points near the window are drawn again
+            indices, segments = line_set.window(
+                xmin=sub_params.xmin or xlim_low, xmax=sub_params.xmax or xlim_high,
+                ymin=sub_params.ymin or ylim_low, ymax=sub_params.ymax or ylim_high)
+            inner.add_collection(LineCollection(segments, colors=[line_set.colors[idx] for idx in indices],
+                                                linewidths=line_set.line_widths[indices],
+                                                linestyles=[line_set.line_styles[idx] for idx in indices],
+                                                rasterized=bool(rasterized[indices].any())))
+        marker_lines = []
+        for axes in ([ax] if inner is None else [ax, inner]):
+            # the lines are drawn by the collection, here we only draw the markers above them
+            for idx in np.flatnonzero(line_set.has_marker):
+                line, = axes.plot(line_set.xs[idx], line_set.ys[idx], color=line_set.colors[idx], linestyle='none',
+                                  marker=line_set.markers[idx], markersize=line_set.marker_sizes[idx],
+                                  markevery=line_set.mark_everys[idx], rasterized=bool(rasterized[idx]))
+                if axes is ax:
+                    marker_lines.append(line)
+        if plot_params.show_text:
+            for idx in np.flatnonzero(line_set.show_texts):
+                ax.text(x=line_set.text_xs[idx], y=line_set.text_ys[idx], s=line_set.labels[idx],
+                        c=line_set.text_colors[idx], fontsize=line_set.text_fontsizes[idx])
+        for idx in np.flatnonzero(line_set.show_labels):
+            # artist not added to the axes, used as the legend handle of this line only
+            line = Line2D([], [], color=line_set.colors[idx], marker=line_set.markers[idx],
+                          markersize=line_set.marker_sizes[idx], linewidth=line_set.line_widths[idx],
+                          linestyle=line_set.line_styles[idx], label=line_set.labels[idx])
+            label_lines.append((line_set.labels[idx], line))
+        ax.set_xscale(xscale)
+        ax.set_yscale(yscale)
+        if prelog_x:
+            # x values are log10 of the data, ticks show 10^x as the log scale does
+            ax.xaxis.set_major_locator(MaxNLocator(integer=True))
+            ax.xaxis.set_major_formatter(FuncFormatter(lambda v, _: f"$\\mathdefault{{10^{{{v:g}}}}}$"))
+        if xlim_low != DefaultVal.lim_low:
+            ax.set_xlim(left=xlim_low)
+        if xlim_high != DefaultVal.lim_high:
+            ax.set_xlim(right=xlim_high)
+        if ylim_low != DefaultVal.lim_low:
+            ax.set_ylim(bottom=ylim_low)
+        if ylim_high != DefaultVal.lim_high:
+            ax.set_ylim(top=ylim_high)
+        ax.set_xlabel(xlabel=plot_params.xlabel,
+                      fontdict={"weight": plot_params.xlabel_weight,
+                                "size": plot_params.xlabel_size})
+        ax.set_ylabel(ylabel=plot_params.ylabel,
+                      fontdict={"weight": plot_params.ylabel_weight,
+                                "size": plot_params.ylabel_size})
+        if len(plot_params.yticks_val) != len(DefaultVal.empty_ticks):
+            ax.set_yticks(plot_params.yticks_val)
+            ax.set_yticklabels(plot_params.yticks_text)
+        if len(plot_params.xticks_val) != len(DefaultVal.empty_ticks):
+            ax.set_xticks(plot_params.xticks_val)
+            ax.set_xticklabels(plot_params.xticks_text)
+        # direction and size of ticks
+        ax.tick_params(axis='x', labelsize=plot_params.tick_size, direction=plot_params.xtick_direction)
+        ax.tick_params(axis='y', labelsize=plot_params.tick_size, direction=plot_params.ytick_direction)
+        ax.tick_params(axis='both', which='minor', length=0)
+        # v line, all of them are drawn by one collection spanning the whole height of the axes
+        n_vlines = min(len(plot_params.vlines), len(plot_params.vline_width), len(plot_params.vline_color),
+                       len(plot_params.vline_style), len(plot_params.vline_label))
+        if n_vlines > 0:
+            vlines_x = np.asarray(plot_params.vlines[:n_vlines], dtype=np.float64)
+            ax.add_collection(LineCollection([[(x, 0), (x, 1)] for x in vlines_x], transform=ax.get_xaxis_transform(),
+                                             colors=plot_params.vline_color[:n_vlines],
+                                             linewidths=plot_params.vline_width[:n_vlines],
+                                             linestyles=plot_params.vline_style[:n_vlines]), autolim=False)
+            # like axvline, x limits are only changed if some vlines are out of them
+            xmin, xmax = ax.get_xbound()
+            ax.update_datalim(np.column_stack([vlines_x, np.zeros_like(vlines_x)]), updatey=False)
+            if np.any((vlines_x < xmin) | (vlines_x > xmax)):
+                ax.autoscale_view(scaley=False)
         if not plot_params.vline_label_hide:
-            label_line[vline_label].append(line)
-    # display grid
-    if plot_params.show_grid:
-        plt.grid(visible=True, ls=plot_params.grid_linestyle)
-    # hide which boarder
-    for direction in plot_params.no_boarder:
-        ax.spines[direction].set_color('none')
-    for patch in plot_params.patches:
-        if isinstance(patch, Artist):
-            ax.add_artist(patch)
-        elif isinstance(patch, Patch):
-            ax.add_patch(patch)
-    if inner is not None:
-        sub_params = plot_params.sub_params
-        inner.set_xscale(plot_params.xscale)
-        inner.set_yscale(plot_params.yscale)
-        __xmin, __xmax = sub_params.xmin or plot_params.xlim_low, sub_params.xmax or plot_params.xlim_high
-        inner.set_xlim(xmin=__xmin, xmax=__xmax)
-        __ymin, __ymax = sub_params.ymin or plot_params.ylim_low, sub_params.ymax or plot_params.ylim_high
-        inner.set_ylim(ymin=__ymin, ymax=__ymax)
-        if len(sub_params.xticks) == 0 or len(sub_params.xticklabels) == 0:
-            x_indices = [__idx for __idx, __val in enumerate(plot_params.xticks_val) if __xmin <= __val <= __xmax]
-            sub_params.xticks = [plot_params.xticks_val[i] for i in x_indices]
-            sub_params.xticklabels = [plot_params.xticks_text[i] for i in x_indices]
-        print(sub_params.xticks)
-        inner.set_xticks(sub_params.xticks)
-        if len(sub_params.yticks) == 0 or len(sub_params.yticklabels) == 0:
-            y_indices = [__idx for __idx, __val in enumerate(plot_params.yticks_val) if __ymin <= __val <= __ymax]
-            sub_params.yticks = [plot_params.yticks_val[i] for i in y_indices]
-            sub_params.yticklabels = [plot_params.yticks_text[i] for i in y_indices]
-        inner.set_yticks(sub_params.yticks or plot_params.yticks_val)
-        inner.set_xticklabels(sub_params.xticklabels,
-                              fontdict={'size': sub_params.tickfontsize or plot_params.tick_size})
-        inner.set_yticklabels(sub_params.yticklabels,
-                              fontdict={'size': sub_params.tickfontsize or plot_params.tick_size})
-        inner.tick_params(axis='both', which='minor', length=0)
-        mark_inset(ax, inner, loc1=sub_params.mark_inset[0], loc2=sub_params.mark_inset[1])
+            for vline_width, vline_color, vline_style, vline_label in \
+                    zip(plot_params.vline_width[:n_vlines], plot_params.vline_color[:n_vlines],
+                        plot_params.vline_style[:n_vlines], plot_params.vline_label[:n_vlines]):
+                # artist not added to the axes, used as the legend handle of this vline only
+                line = Line2D([], [], linewidth=vline_width, color=vline_color, linestyle=vline_style,
+                              label=vline_label)
+                label_lines.append((vline_label, line))
+        # display grid
+        if plot_params.show_grid:
+            ax.grid(visible=True, ls=plot_params.grid_linestyle)
+        # hide which boarder
+        for direction in plot_params.no_boarder:
+            ax.spines[direction].set_color('none')
+        for patch in plot_params.patches:
+            if isinstance(patch, Artist):
+                ax.add_artist(patch)
+            elif isinstance(patch, Patch):
+                ax.add_patch(patch)
+        if inner is not None:
+            inner.set_xscale(xscale)
+            inner.set_yscale(yscale)
+            __xmin, __xmax = sub_params.xmin or xlim_low, sub_params.xmax or xlim_high
+            inner.set_xlim(xmin=__xmin, xmax=__xmax)
+            __ymin, __ymax = sub_params.ymin or ylim_low, sub_params.ymax or ylim_high
+            inner.set_ylim(ymin=__ymin, ymax=__ymax)
+            if len(sub_params.xticks) == 0 or len(sub_params.xticklabels) == 0:
+                x_indices = [__idx for __idx, __val in enumerate(plot_params.xticks_val) if __xmin <= __val <= __xmax]
+                sub_params.xticks = [plot_params.xticks_val[i] for i in x_indices]
+                sub_params.xticklabels = [plot_params.xticks_text[i] for i in x_indices]
+            print(sub_params.xticks)
+            inner.set_xticks(sub_params.xticks)
+            if len(sub_params.yticks) == 0 or len(sub_params.yticklabels) == 0:
+                y_indices = [__idx for __idx, __val in enumerate(plot_params.yticks_val) if __ymin <= __val <= __ymax]
+                sub_params.yticks = [plot_params.yticks_val[i] for i in y_indices]
+                sub_params.yticklabels = [plot_params.yticks_text[i] for i in y_indices]
+            inner.set_yticks(sub_params.yticks or plot_params.yticks_val)
+            inner.set_xticklabels(sub_params.xticklabels,
+                                  fontdict={'size': sub_params.tickfontsize or plot_params.tick_size})
+            inner.set_yticklabels(sub_params.yticklabels,
+                                  fontdict={'size': sub_params.tickfontsize or plot_params.tick_size})
+            inner.tick_params(axis='both', which='minor', length=0)
+            mark_inset(ax, inner, loc1=sub_params.mark_inset[0], loc2=sub_params.mark_inset[1])
+            pass
+
+        if plot_params.legend_loc != DefaultVal.legend:
+            # handles of the same label are merged, labels are in the order they first appear
+            first_seen = {}
+            for idx, (label, _) in enumerate(label_lines):
+                first_seen.setdefault(label, idx)
+            label_lines.sort(key=lambda label_line: first_seen[label_line[0]])
+            groups = [(label, tuple(line for _, line in group))
+                      for label, group in groupby(label_lines, key=itemgetter(0))]
+            # only labels shared by several lines need HandlerTuple to merge their handles
+            handles = [lines[0] if len(lines) == 1 else lines for _, lines in groups]
+            has_tuple = any(len(lines) > 1 for _, lines in groups)
+            ax.legend(handles,
+                      [label for label, _ in groups],
+                      handlelength=plot_params.legend_handle_length,
+                      loc=plot_params.legend_loc,
+                      fontsize=plot_params.legend_fontsize,
+                      handler_map={tuple: HandlerTuple(ndivide=1)} if has_tuple else None,
+                      frameon=plot_params.legend_frameon)
+        if plot_params.tight_layout:
+            # compute the margins once, instead of an auto layout which runs again on every draw
+            layout_key = self.layout_key(plot_params)
+            subplotpars = self.layouts.get(layout_key)
+            if subplotpars is None:
+                fig.tight_layout()
+                subplotpars = {k: getattr(fig.subplotpars, k)
+                               for k in ('left', 'right', 'bottom', 'top', 'wspace', 'hspace')}
+                if layout_key is not None:
+                    self.layouts[layout_key] = subplotpars
+            else:
+                fig.subplots_adjust(**subplotpars)
+        self.save(plot_params)
+        self.fingerprint, self.artists = fingerprint, (curves, marker_lines)
         pass
 
-    if plot_params.legend_loc != DefaultVal.legend:
-        ax.legend([tuple(label_line[k]) for k in label_line.keys()],
-                  [label for label in label_line.keys()],
-                  handlelength=plot_params.legend_handle_length,
-                  loc=plot_params.legend_loc,
-                  fontsize=plot_params.legend_fontsize,
-                  handler_map={tuple: HandlerTuple(ndivide=1)}, frameon=plot_params.legend_frameon)
-    plt.savefig(plot_params.save)
-    plt.close(fig)
+
+# figure kept for later calls of curve() in this process
+_fig_cache = Plotter()
+
+
+def curve(line_data: List[Dict[Any, Any]], plot_params: PlotParams, plotter: Optional[Plotter] = None):
+    """
+    :param line_data: parsed json files
+    :param plot_params: params of the figure
+    :param plotter: draw on the figure of this plotter, None to use the figure cached in this module
+    """
+    plotter = _fig_cache if plotter is None else plotter
+    plotter.curve(line_data=line_data, plot_params=plot_params)
+    pass
+
+
+def draw(line_data: List[Dict[Any, Any]], plot_params: PlotParams, plotter: Optional[Plotter] = None):
+    """
+    Draw and save one figure, with cairo if --fast is set and the scales are supported, otherwise with matplotlib
+    :param line_data: parsed json files
+    :param plot_params: params of the figure
+    :param plotter: draw on the figure of this plotter, None to use the figure cached in this module
+    """
+    if plot_params.fast and plot_params.xscale in ('linear', 'log') and plot_params.yscale in ('linear', 'log'):
+        fast_curve(line_data=line_data, plot_params=plot_params)
+    else:
+        curve(line_data=line_data, plot_params=plot_params, plotter=plotter)
+    pass
+
+
+# number of processes drawing and saving figures with --async-save
+async_save_workers = 2
+
+
+def curve_many(groups: List[Tuple[List[Dict[Any, Any]], PlotParams]], async_save: bool = False):
+    """
+    Draw many figures one by one on the same figure
+    :param groups: parsed json files and params of each figure
+    :param async_save: draw and save figures in worker processes, each of them reuses its own figure.
+            This returns after all figures are saved
+    """
+    if async_save and len(groups) > 1:
+        with ProcessPoolExecutor(max_workers=min(async_save_workers, len(groups))) as executor:
+            futures = [executor.submit(draw, line_data, plot_params) for line_data, plot_params in groups]
+            for future in futures:
+                future.result()
+        return
+    plotter = Plotter()
+    try:
+        for line_data, plot_params in groups:
+            draw(line_data=line_data, plot_params=plot_params, plotter=plotter)
+    finally:
+        plotter.close()
+    pass
+
+
+def fast_curve(line_data: List[Dict[Any, Any]], plot_params: PlotParams):
+    """
+    Draw lines, vlines, grid, ticks and labels with cairo directly, which is much faster than matplotlib.
+    Legend, texts, patches and inset axes are not drawn, and only linear and log scales are supported.
+    Tick texts are drawn as plain texts, `$` and braces of mathtext are removed
+    :param line_data: parsed json files
+    :param plot_params: params of the figure
+    """
+    import cairo
+    from matplotlib.colors import to_rgba
+    line_set = build_line_set(line_data, plot_params)
+
+    def scaled(values, scale):
+        values = np.asarray(values, dtype=np.float64)
+        if scale == 'log':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.log10(np.where(values > 0, values, np.nan))
+        return values
+
+    def bound(value, default, scale):
+        return np.nan if value == default else scaled([value], scale)[0]
+
+    def limits(low, high, values):
+        finite = values[np.isfinite(values)]
+        low = finite.min() if np.isnan(low) and len(finite) > 0 else low
+        high = finite.max() if np.isnan(high) and len(finite) > 0 else high
+        low, high = (0.0 if np.isnan(low) else low), (1.0 if np.isnan(high) else high)
+        return (low, high) if high > low else (low - 0.5, low + 0.5)
+
+    def default_ticks(low, high, scale):
+        if scale == 'log':
+            vals = np.arange(np.ceil(low), np.floor(high) + 1)
+            return list(vals), [f"1e{int(v)}" for v in vals]
+        vals = np.linspace(low, high, 6)
+        return list(vals), [f"{v:g}" for v in vals]
+
+    def plain(text):
+        return str(text).replace("$", "").replace("{", "").replace("}", "")
+
+    all_x = np.concatenate([scaled(x_list, plot_params.xscale) for x_list in line_set.xs] or [np.zeros(0)])
+    all_y = np.concatenate([scaled(y_list, plot_params.yscale) for y_list in line_set.ys] or [np.zeros(0)])
+    xlow, xhigh = limits(bound(plot_params.xlim_low, DefaultVal.lim_low, plot_params.xscale),
+                         bound(plot_params.xlim_high, DefaultVal.lim_high, plot_params.xscale), all_x)
+    ylow, yhigh = limits(bound(plot_params.ylim_low, DefaultVal.lim_low, plot_params.yscale),
+                         bound(plot_params.ylim_high, DefaultVal.lim_high, plot_params.yscale), all_y)
+
+    # sizes are in points, png files are scaled to 100 dpi as matplotlib does by default
+    width, height = [v * 72 for v in (plot_params.fig_size or matplotlib.rcParams['figure.figsize'])]
+    if plot_params.save.endswith('.pdf'):
+        surface = cairo.PDFSurface(plot_params.save, width, height)
+    elif plot_params.save.endswith('.svg'):
+        surface = cairo.SVGSurface(plot_params.save, width, height)
+    else:
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, int(width * 100 / 72), int(height * 100 / 72))
+    ctx = cairo.Context(surface)
+    if isinstance(surface, cairo.ImageSurface):
+        ctx.scale(100 / 72, 100 / 72)
+        ctx.set_source_rgb(1, 1, 1)
+        ctx.paint()
+    ctx.select_font_face("sans-serif", cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_NORMAL)
+    left = plot_params.tick_size * 4 + plot_params.ylabel_size * 2
+    bottom = plot_params.tick_size * 2 + plot_params.xlabel_size * 2
+    right, top = 15, 10
+    plot_w, plot_h = width - left - right, height - top - bottom
+
+    def to_px(x, y):
+        return left + (x - xlow) / (xhigh - xlow) * plot_w, top + (yhigh - y) / (yhigh - ylow) * plot_h
+
+    if len(plot_params.xticks_val) > 0:
+        xticks, xtexts = list(scaled(plot_params.xticks_val, plot_params.xscale)), plot_params.xticks_text
+    else:
+        xticks, xtexts = default_ticks(xlow, xhigh, plot_params.xscale)
+    if len(plot_params.yticks_val) > 0:
+        yticks, ytexts = list(scaled(plot_params.yticks_val, plot_params.yscale)), plot_params.yticks_text
+    else:
+        yticks, ytexts = default_ticks(ylow, yhigh, plot_params.yscale)
+    xticks_in = [(x, t) for x, t in zip(xticks, xtexts) if np.isfinite(x) and xlow <= x <= xhigh]
+    yticks_in = [(y, t) for y, t in zip(yticks, ytexts) if np.isfinite(y) and ylow <= y <= yhigh]
+
+    if plot_params.show_grid:
+        ctx.save()
+        ctx.set_source_rgba(*to_rgba(matplotlib.rcParams['grid.color']))
+        ctx.set_line_width(matplotlib.rcParams['grid.linewidth'])
+        ctx.set_dash([3.7, 1.6])
+        for x, _ in xticks_in:
+            px, _ = to_px(x, ylow)
+            ctx.move_to(px, top)
+            ctx.line_to(px, top + plot_h)
+        for y, _ in yticks_in:
+            _, py = to_px(xlow, y)
+            ctx.move_to(left, py)
+            ctx.line_to(left + plot_w, py)
+        ctx.stroke()
+        ctx.restore()
+
+    # lines and vlines are clipped by the plot area
+    ctx.save()
+    ctx.rectangle(left, top, plot_w, plot_h)
+    ctx.clip()
+    dashes = {'-': [], 'solid': [], '--': [3.7, 1.6], 'dashed': [3.7, 1.6], '-.': [6.4, 1.6, 1.0, 1.6],
+              'dashdot': [6.4, 1.6, 1.0, 1.6], ':': [1.0, 1.65], 'dotted': [1.0, 1.65]}
+
+    def set_style(color, line_width, line_style):
+        ctx.set_source_rgba(*to_rgba(color))
+        ctx.set_line_width(line_width)
+        # matplotlib scales dash patterns with line widths
+        if isinstance(line_style, tuple):
+            ctx.set_dash([v * line_width for v in line_style[1]], line_style[0] * line_width)
+        else:
+            ctx.set_dash([v * line_width for v in dashes.get(line_style, [])])
+
+    for idx in range(len(line_set)):
+        px, py = to_px(scaled(line_set.xs[idx], plot_params.xscale), scaled(line_set.ys[idx], plot_params.yscale))
+        valid = np.isfinite(px) & np.isfinite(py)
+        px, py = px[valid], py[valid]
+        if len(px) == 0:
+            continue
+        set_style(line_set.colors[idx], line_set.line_widths[idx], line_set.line_styles[idx])
+        ctx.move_to(px[0], py[0])
+        for x, y in zip(px[1:].tolist(), py[1:].tolist()):
+            ctx.line_to(x, y)
+        ctx.stroke()
+        mark_every = line_set.mark_everys[idx]
+        if line_set.has_marker[idx] and (mark_every is None or isinstance(mark_every, int)):
+            radius = (line_set.marker_sizes[idx] or matplotlib.rcParams['lines.markersize']) / 2
+            for x, y in zip(px[::mark_every or 1].tolist(), py[::mark_every or 1].tolist()):
+                ctx.new_sub_path()
+                ctx.arc(x, y, radius, 0, 2 * np.pi)
+            ctx.fill()
+    for vline_x, vline_width, vline_color, vline_style in \
+            zip(plot_params.vlines, plot_params.vline_width, plot_params.vline_color, plot_params.vline_style):
+        px, _ = to_px(scaled([vline_x], plot_params.xscale)[0], ylow)
+        if not np.isfinite(px):
+            continue
+        set_style(vline_color, vline_width, vline_style)
+        ctx.move_to(px, top)
+        ctx.line_to(px, top + plot_h)
+        ctx.stroke()
+    ctx.restore()
+
+    # boarders, ticks and labels
+    ctx.set_source_rgb(0, 0, 0)
+    ctx.set_line_width(matplotlib.rcParams['axes.linewidth'])
+    ctx.set_dash([])
+    corners = {"top": ((left, top), (left + plot_w, top)),
+               "bottom": ((left, top + plot_h), (left + plot_w, top + plot_h)),
+               "left": ((left, top), (left, top + plot_h)),
+               "right": ((left + plot_w, top), (left + plot_w, top + plot_h))}
+    for direction, (start, end) in corners.items():
+        if direction not in plot_params.no_boarder:
+            ctx.move_to(*start)
+            ctx.line_to(*end)
+    tick_len = 3.5
+    ctx.set_font_size(plot_params.tick_size)
+    for x, text in xticks_in:
+        px, _ = to_px(x, ylow)
+        ctx.move_to(px, top + plot_h)
+        ctx.line_to(px, top + plot_h + (tick_len if plot_params.xtick_direction != 'in' else -tick_len))
+        extents = ctx.text_extents(plain(text))
+        ctx.stroke()
+        ctx.move_to(px - extents.width / 2 - extents.x_bearing, top + plot_h + tick_len + 2 - extents.y_bearing)
+        ctx.show_text(plain(text))
+    for y, text in yticks_in:
+        _, py = to_px(xlow, y)
+        ctx.move_to(left, py)
+        ctx.line_to(left - (tick_len if plot_params.ytick_direction != 'in' else -tick_len), py)
+        extents = ctx.text_extents(plain(text))
+        ctx.stroke()
+        ctx.move_to(left - tick_len - 2 - extents.width - extents.x_bearing,
+                    py - extents.height / 2 - extents.y_bearing)
+        ctx.show_text(plain(text))
+    ctx.stroke()
+    ctx.set_font_size(plot_params.xlabel_size)
+    extents = ctx.text_extents(plot_params.xlabel)
+    ctx.move_to(left + plot_w / 2 - extents.width / 2, height - plot_params.xlabel_size / 2)
+    ctx.show_text(plot_params.xlabel)
+    ctx.set_font_size(plot_params.ylabel_size)
+    extents = ctx.text_extents(plot_params.ylabel)
+    ctx.save()
+    ctx.move_to(plot_params.ylabel_size * 1.2, top + plot_h / 2 + extents.width / 2)
+    ctx.rotate(-np.pi / 2)
+    ctx.show_text(plot_params.ylabel)
+    ctx.restore()
+    if isinstance(surface, cairo.ImageSurface):
+        surface.write_to_png(plot_params.save)
+    surface.finish()
     pass
 
 
@@ -326,10 +1211,12 @@ def main():
     }
     cli = argparse.ArgumentParser("Curver: An Easy Guess-Crack Curve Drawer")
     valid_suffix = [".pdf", ".png", '.svg']
-    cli.add_argument("-f", "--files", required=True, dest="json_files", nargs="+", type=argparse.FileType("r"),
-                     help="json files generated by gcutify")
-    cli.add_argument("-s", "--save", required=True, dest="fd_save", type=str,
-                     help="save figure here")
+    cli.add_argument("-f", "--files", required=True, dest="json_files", nargs="+",
+                     type=argparse.FileType("rb", bufsize=json_buffer_size), action="append",
+                     help="json files generated by gcutify. Use -f again for another figure, "
+                          "figures are drawn with the same settings")
+    cli.add_argument("-s", "--save", required=True, dest="fd_save", type=str, action="append",
+                     help="save figure here, each -f should have its own -s in the same order")
     cli.add_argument("--suffix", dest="suffix", required=False, default=".pdf", type=str, choices=valid_suffix,
                      help="suffix of file to save figure, if specified file ends with 'suffix', "
                           "suffix here will be ignored.")
@@ -411,6 +1298,34 @@ def main():
     cli.add_argument("--no-boarder", required=False, dest="no_boarder", type=str, nargs='*',
                      default=[], choices=["left", "bottom", "top", "right"],
                      help='do not display boarder listed here')
+    cli.add_argument("--max-points", required=False, dest="max_points", type=int, default=20000,
+                     help="draw at most this number of points for each line without markers, "
+                          "set it to 0 to draw all points")
+    cli.add_argument("--downsample", required=False, dest="downsample", type=str, default="bins",
+                     choices=["bins", "lttb"],
+                     help="bins: keep the first and the last points in each of `--max-points / 2` bins of x; "
+                          "lttb: keep twice the pixels of the figure width (at most --max-points) points "
+                          "by Largest-Triangle-Three-Buckets")
+    cli.add_argument("--prelog-x", required=False, dest="prelog_x", action="store_true",
+                     help="with log x axis, draw log10 of x values on a linear axis to skip transforming "
+                          "all points when drawing. Ignored if --inset-axes or --patches is used")
+    cli.add_argument("--cache-dir", required=False, dest="cache_dir", type=str, default=None,
+                     help="save parsed json files here as npz files, so that plotting them again is faster. "
+                          "Files in it are never removed automatically. By default json files are always parsed")
+    cli.add_argument("--fast", required=False, dest="fast", action="store_true",
+                     help="draw lines, vlines, grid, ticks and labels with cairo instead of matplotlib, "
+                          "which is much faster. Legend, texts, patches and inset axes are not drawn, "
+                          "only linear and log scales are supported")
+    cli.add_argument("--no-rasterize", required=False, dest="no_rasterize", action="store_true",
+                     help="keep all curves as vector paths in pdf and svg files, which may be slow to view "
+                          "if curves have many points")
+    cli.add_argument("--raster-points", required=False, dest="raster_points", type=int, default=20000,
+                     help="curves with more points than this after downsampling are rasterized "
+                          "in pdf and svg files, unless --no-rasterize is set")
+    cli.add_argument("--async-save", required=False, dest="async_save", action="store_true",
+                     help="draw and save figures of several -f in worker processes")
+    cli.add_argument("--raster-dpi", required=False, dest="raster_dpi", type=float, default=300,
+                     help="resolution of rasterized curves in pdf and svg files")
     cli.add_argument("--show-text", required=False, dest="show_text", action="store_true",
                      help="show label text at right")
     cli.add_argument("--font", required=False, dest="global_font", default=None, type=str,
@@ -441,31 +1356,36 @@ def main():
 
     def patch_type(v):
         """
-        read the pickle file and obtain the list of patches
+        check the pickle file, the list of patches is loaded when it is used
         :param v: pickle file which contains a list of patches
-        :return: parsed patches
+        :return: lazily loaded patches
         """
-        try:
-            with open(v, 'rb') as fin:
-                res = pickle.load(fin)
-                return res
-        except Exception as e:
-            print(e, file=sys.stderr)
+        if not os.path.isfile(v):
+            print(f"{v} is not a file", file=sys.stderr)
             sys.exit(-1)
-        pass
+        return LazyPatches(v)
 
     cli.add_argument("--patches", required=False, dest="patches", default=[], type=patch_type,
                      help="Specify the pickle file which contains the list of patches")
     args = cli.parse_args()
     if args.global_font is not None:
         conf_font(args.global_font)
-    suffix_ok = any([args.fd_save.endswith(suffix) for suffix in valid_suffix])
-    if not suffix_ok:
-        args.fd_save += args.suffix
+    if len(args.json_files) != len(args.fd_save):
+        print(f"Each -f ({len(args.json_files)}) should have its own -s ({len(args.fd_save)})", file=sys.stderr)
+        sys.exit(-1)
     args.vline_style = [line_style_dict[vline_style] for vline_style in args.vline_style]
     args.grid_linestyle = line_style_dict[args.grid_linestyle]
-    plot_params = PlotParams(args)
-    curve(json_files=args.json_files, plot_params=plot_params, close_fd=True)
+    # reading and parsing json files are independent, while plotting has to be done in this thread
+    line_data = load_json_files([json_file for json_files in args.json_files for json_file in json_files],
+                                close_fd=True, cache_dir=args.cache_dir)
+    groups = []
+    saves = args.fd_save
+    for json_files, save in zip(args.json_files, saves):
+        suffix_ok = any([save.endswith(suffix) for suffix in valid_suffix])
+        args.fd_save = save if suffix_ok else save + args.suffix
+        groups.append((line_data[:len(json_files)], PlotParams(args)))
+        line_data = line_data[len(json_files):]
+    curve_many(groups, async_save=args.async_save)
     pass
 
 
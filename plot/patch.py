@@ -1,8 +1,10 @@
 import argparse
+import functools
 import json
+import os
 import pickle
 import typing
-from json import JSONDecodeError
+from types import MappingProxyType
 
 import sys
 
@@ -22,10 +24,22 @@ coords = ["figure points", "figure pixels", "figure fraction", "subfigure points
           'axes fraction',
           'data', 'polar']
 func_name = "from_argv"
+# the first character of a json value, i.e., string, list, object, number, true, false, null, NaN or Infinity
+json_starts = frozenset('"[{-0123456789tfnNI')
 save_name = "--save"
-
-
-def get_sub_classes(base: type, attr_name='name') -> typing.Dict[str, type]:
+# artists are written to this temporary file first, which replaces the file to save only if all commands are valid
+tmp_suffix = ".tmp"
+
+
+@functools.lru_cache(maxsize=None)
+def get_sub_classes(base: type, attr_name='name') -> typing.Mapping[str, type]:
+    """
+    Sub classes of base are known once the module is imported, so the result is cached.
+    A read-only view is returned, since the same mapping is shared by all callers
+    :param base: base class
+    :param attr_name: name of the attribute identifying each sub class
+    :return: value of the attribute -> sub class
+    """
     d = {}
     assert hasattr(base, attr_name)
     for sub_cls in base.__subclasses__():
@@ -37,7 +51,7 @@ def get_sub_classes(base: type, attr_name='name') -> typing.Dict[str, type]:
             d[val] = sub_cls
         else:
             print(f"{val.__name__} in {sub_cls.__name__} is callable")
-    return d
+    return MappingProxyType(d)
 
 
 # con = ConnectionPatch((0.2, 0.2), (0.8, 0.8), "data", "data", arrowstyle="->", shrinkA=5, shrinkB=5,
@@ -48,17 +62,29 @@ def get_sub_classes(base: type, attr_name='name') -> typing.Dict[str, type]:
 
 class Base:
     name = "base"
+    # argument parser of each sub class, built the first time it is used
+    _cli: typing.Optional[argparse.ArgumentParser] = None
+
+    @classmethod
+    def build_cli(cls) -> argparse.ArgumentParser:
+        raise NotImplementedError
+
+    @classmethod
+    def get_cli(cls) -> argparse.ArgumentParser:
+        if cls.__dict__.get('_cli') is None:
+            cls._cli = cls.build_cli()
+        return cls._cli
 
-    @staticmethod
-    def from_argv(argv: typing.List[str]) -> typing.Tuple[typing.Dict, Artist]:
+    @classmethod
+    def from_argv(cls, argv: typing.List[str]) -> typing.Tuple[typing.Dict, Artist]:
         raise NotImplementedError
 
 
 class AugAnnotation(Base):
     name = "annotation"
 
-    @staticmethod
-    def from_argv(argv: typing.List[str]):
+    @classmethod
+    def build_cli(cls) -> argparse.ArgumentParser:
         cli = argparse.ArgumentParser(f"Checking {AugConn.name} configuration")
         cli.add_argument("--text", dest="text", type=str, required=True, help="the text of the annotation")
         cli.add_argument("--xy", dest="xy", type=float, required=True, nargs=2,
@@ -76,6 +102,11 @@ class AugAnnotation(Base):
         cli.add_argument("--expert", dest="expert", type=str, nargs='+', required=False, default=[],
                          help="If you are an expert of Matplotlib, you may set additional configurations here.\n"
                               "E.g., --expert color=red facecolor=blue")
+        return cli
+
+    @classmethod
+    def from_argv(cls, argv: typing.List[str]):
+        cli = cls.get_cli()
         if not argv:
             cli.print_help()
             return {}, None
@@ -92,8 +123,8 @@ class AugAnnotation(Base):
 class AugText(Base):
     name = "text"
 
-    @staticmethod
-    def from_argv(argv: typing.List[str]):
+    @classmethod
+    def build_cli(cls) -> argparse.ArgumentParser:
         cli = argparse.ArgumentParser(f"Checking {AugText.name} configuration")
 
         cli.add_argument("-x", "--x-coord", dest="x", type=float, required=True, help="x of the annotation text")
@@ -102,6 +133,11 @@ class AugText(Base):
         cli.add_argument("--expert", dest="expert", type=str, nargs='+', required=False, default=[],
                          help="If you are an expert of Matplotlib, you may set additional configurations here.\n"
                               "E.g., --expert color=red facecolor=blue")
+        return cli
+
+    @classmethod
+    def from_argv(cls, argv: typing.List[str]):
+        cli = cls.get_cli()
         if not argv:
             cli.print_help()
             return {}, None
@@ -115,8 +151,8 @@ class AugText(Base):
 class AugConn(Base):
     name = "connection"
 
-    @staticmethod
-    def from_argv(argv: typing.List[str]):
+    @classmethod
+    def build_cli(cls) -> argparse.ArgumentParser:
         cli = argparse.ArgumentParser(f"Checking {AugConn.name} configuration")
 
         cli.add_argument("-a", "--a-xy", dest="a", type=float, nargs=2, required=True,
@@ -133,6 +169,11 @@ class AugConn(Base):
         cli.add_argument("--expert", dest="expert", type=str, nargs='+', required=False, default=[],
                          help="If you are an expert of Matplotlib, you may set additional configurations here.\n"
                               "E.g., --expert color=red facecolor=blue")
+        return cli
+
+    @classmethod
+    def from_argv(cls, argv: typing.List[str]):
+        cli = cls.get_cli()
         if not argv:
             cli.print_help()
             return {}, None
@@ -153,8 +194,8 @@ class AugEllipse(Base):
         self.__conf = dict(xy=b, width=width, height=height, angle=angle, **kwargs)
         pass
 
-    @staticmethod
-    def from_argv(argv: typing.List[str]):
+    @classmethod
+    def build_cli(cls) -> argparse.ArgumentParser:
         cli = argparse.ArgumentParser(f"Checking {AugEllipse.name} configuration")
 
         cli.add_argument("-x", "--x-coord", dest="x", type=float, required=True, help="x of the center of the ellipse")
@@ -165,6 +206,11 @@ class AugEllipse(Base):
         cli.add_argument("--expert", dest="expert", type=str, nargs='+', required=False, default=[],
                          help="If you are an expert of Matplotlib, you may set additional configurations here.\n"
                               "E.g., --expert color=red facecolor=blue")
+        return cli
+
+    @classmethod
+    def from_argv(cls, argv: typing.List[str]):
+        cli = cls.get_cli()
         if not argv:
             cli.print_help()
             return {}, None
@@ -183,30 +229,32 @@ def parse_expert(expert_opts: typing.List[str]):
     if expert_opts is None:
         return parsed
     for item in expert_opts:  # type: str
-        idx_eq = item.find('=')
-        if idx_eq == -1:
+        opt, sep, val = item.partition('=')
+        if not sep:
             print(f"[ERROR] Sorry, your configuration of {item} seems invalid.\n"
                   f"A valid option should be like: color=red", file=sys.stderr)
             sys.exit(-1)
-        opt = item[:idx_eq]
-        val = item[idx_eq + 1:]
-        try:
-            val = json.loads(val)
-        except JSONDecodeError:
+        if val.lstrip()[:1] in json_starts:
             try:
-                val = json.loads(f'"{val}"')
-            except JSONDecodeError as e1:
-                print(e1)
-                print(f"[ERROR] The val ``{val}`` has to be in valid format of json.\n"
-                      f"E.g.\tcolor=[\"red\", \"green\"]\n"
-                      f"\trgb=[1, 2, 3]\n"
-                      f"The outer parenthesis will be automatically wrapped.\n"
-                      f"However, the inner parenthesis should be wrapped by users themselves.\n"
-                      f"Note that [\"1\", \"2\", \"3\"] is different from [1, 2, 3]:\n"
-                      f"the former is a list of string, while the latter is a list of integers",
-                      file=sys.stderr)
-                sys.exit(-2)
-        parsed[opt] = val
+                parsed[opt] = json.loads(val)
+                continue
+            except ValueError:
+                # values such as 1px only look like json, they are strings as well
+                pass
+        try:
+            # values such as red can not be json, so they are wrapped by quotes directly
+            parsed[opt] = json.loads(f'"{val}"')
+        except ValueError as e1:
+            print(e1)
+            print(f"[ERROR] The val ``{val}`` has to be in valid format of json.\n"
+                  f"E.g.\tcolor=[\"red\", \"green\"]\n"
+                  f"\trgb=[1, 2, 3]\n"
+                  f"The outer parenthesis will be automatically wrapped.\n"
+                  f"However, the inner parenthesis should be wrapped by users themselves.\n"
+                  f"Note that [\"1\", \"2\", \"3\"] is different from [1, 2, 3]:\n"
+                  f"the former is a list of string, while the latter is a list of integers",
+                  file=sys.stderr)
+            sys.exit(-2)
     return parsed
     pass
 
@@ -229,12 +277,7 @@ def print_help(names: typing.Dict[str, type], argv: typing.List[str]):
                 print(f"This command is invalid because we fail to find callable ``{func_name}`` function in the code")
 
 
-def check_help(argv: typing.List[str], names: typing.Dict[str, type]):
-    h = {"-h", "--help", "--h", "-help"}
-    for v in argv:
-        if v in h:
-            print_help(names, argv)
-            sys.exit(0)
+help_flags = frozenset({"-h", "--help", "--h", "-help"})
 
 
 def get_save_path(argv: typing.List[str]):
@@ -246,7 +289,7 @@ def get_save_path(argv: typing.List[str]):
             filename = argv[idx + 1]
             if not filename.endswith(".pickle"):
                 filename += ".pickle"
-            fb_out = open(filename, 'wb')
+            fb_out = open(filename + tmp_suffix, 'wb')
             found = idx
             break
     if found != -1:
@@ -255,20 +298,35 @@ def get_save_path(argv: typing.List[str]):
     return n_argv, fb_out
 
 
+def discard_save(fb_out: typing.IO):
+    """
+    Remove the temporary file of artists, nothing is saved
+    """
+    if fb_out is not sys.stdout:
+        fb_out.close()
+        os.remove(fb_out.name)
+    pass
+
+
 def get_argv(names: typing.Dict[str, type]) -> \
         typing.Tuple[typing.Dict[str, typing.List[typing.List[str]]], typing.TextIO]:
     argv = sys.argv
     argv, fb_out = get_save_path(argv)
-    check_help(argv=argv, names=names)
-    indices_dict = []  # {"text": -1, "connection": -1, "ellipse": -1}
+    name_set = frozenset(names)
+    indices = []  # [(1, "text"), (5, "connection")]
+    # help flags and command names are found in the same pass over argv
     for i, v in enumerate(argv):
-        if v in names:
-            indices_dict.append((v, i))
+        if v in help_flags:
+            discard_save(fb_out)
+            print_help(names, argv)
+            sys.exit(0)
+        elif v in name_set:
+            indices.append((i, v))
     end = len(argv)
     argv_dict = {k: [] for k in names}  # {"text": [], "connection": [], "ellipse": []}
-    for name, idx in sorted(indices_dict, key=lambda x: x[1], reverse=True):
-        argv4cmd = argv[idx + 1: end]
-        argv_dict[name].append(argv4cmd)
+    # indices are ascending, scanning them backwards gives the end of each command
+    for idx, name in reversed(indices):
+        argv_dict[name].append(argv[idx + 1: end])
         end = idx
     return argv_dict, fb_out
 
@@ -277,22 +335,32 @@ def wrapper():
     names = get_sub_classes(Base)
     argv_dict, fb_save = get_argv(names)
     configurations = []
-    arts = []
-    for name, commands in argv_dict.items():
-        func = getattr(names[name], func_name, "default")
-        if not callable(func):
-            sys.exit(f"Fail to find `{func_name}` function in {name}")
-        for cmd in commands:
-            conf, art = func(cmd)
-            if art is None:
-                print(f"Invalid command found for {name}:\n"
-                      f"Details of the command: `{' '.join(cmd)}`")
-                sys.exit(4)
-                pass
-            configurations.append(conf)
-            arts.append(art)
-        pass
-    pickle.dump(arts, fb_save)
+    # artists are written one by one as they are created, instead of pickling a list of all of them at the end
+    pickler = pickle.Pickler(fb_save, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        for name, commands in argv_dict.items():
+            func = getattr(names[name], func_name, "default")
+            if not callable(func):
+                sys.exit(f"Fail to find `{func_name}` function in {name}")
+            for cmd in commands:
+                conf, art = func(cmd)
+                if art is None:
+                    print(f"Invalid command found for {name}:\n"
+                          f"Details of the command: `{' '.join(cmd)}`")
+                    sys.exit(4)
+                    pass
+                configurations.append(conf)
+                pickler.dump(art)
+                # every artist can be loaded by its own pickle.load
+                pickler.clear_memo()
+            pass
+    except BaseException:
+        # argparse exits as well when a command is invalid, the artists written so far are dropped
+        discard_save(fb_save)
+        raise
+    if fb_save is not sys.stdout:
+        fb_save.close()
+        os.replace(fb_save.name, fb_save.name[:-len(tmp_suffix)])
     print(f"[DEBUG]: {json.dumps(configurations)}", file=sys.stderr)
     pass
 